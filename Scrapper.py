@@ -1,27 +1,39 @@
 import re
 import os
+import sys
+import json
+import time
 import hashlib
+import argparse
 from icrawler.builtin import BingImageCrawler, GoogleImageCrawler
-from threading import Thread
+from threading import Thread, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dedup import HashIndex, dhash, DEFAULT_NEAR_DUPLICATE_THRESHOLD, DEFAULT_HASH_INDEX
 
 SAVE_DIR = "downloads"
+HASH_CHUNK_SIZE = 64 * 1024
+ENGINES = ("bing", "google")
+BATCH_WORKERS = 4           # crawls running at once across the whole batch
+BATCH_ENGINE_LIMIT = 2      # crawls running at once per engine
+MANIFEST_NAME = "manifest.json"
 
 def file_hash(path):
     """Compute MD5 hash of a file (for duplicate detection)."""
     hasher = hashlib.md5()
     with open(path, "rb") as f:
-        buf = f.read()
-        hasher.update(buf)
+        # read in fixed-size chunks so memory stays flat for large images
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
     return hasher.hexdigest()
 
-def scrape_images(query, num_images, engine="bing"):
+def scrape_images(query, num_images, engine="bing", downloader_threads=8):
     save_dir = os.path.join(SAVE_DIR, query, engine)
     os.makedirs(save_dir, exist_ok=True)
 
     if engine == "google":
-        crawler = GoogleImageCrawler(downloader_threads=8, storage={"root_dir": save_dir})
+        crawler = GoogleImageCrawler(downloader_threads=downloader_threads, storage={"root_dir": save_dir})
     else:
-        crawler = BingImageCrawler(downloader_threads=8, storage={"root_dir": save_dir})
+        crawler = BingImageCrawler(downloader_threads=downloader_threads, storage={"root_dir": save_dir})
 
     crawler.crawl(keyword=query, max_num=num_images * 2)  # overshoot for duplicates
 
@@ -37,39 +49,178 @@ def safe_folder_name(name: str) -> str:
     return name
 
 
-def merge_and_deduplicate(query, quantity, engine_folders):
+def merge_files(query, quantity, engine_folders, index):
+    """Move new images into the topic folder until it holds quantity; returns [(file, md5, engine)].
+
+    Anything already in the hash index, under any topic, counts as a duplicate.
+    """
     final_dir = os.path.join(SAVE_DIR, query)
     os.makedirs(final_dir, exist_ok=True)
 
-    seen_hashes = set()
-    count = 1
+    # top up an existing folder instead of overwriting 1.jpg, 2.jpg, ...
+    existing = [f for f in os.listdir(final_dir) if os.path.isfile(os.path.join(final_dir, f))]
+    numbers = [int(f.split(".")[0]) for f in existing if f.split(".")[0].isdigit()]
+    next_number = max(numbers, default=0) + 1
+    room = quantity - len(existing)
 
+    kept = []
     for folder in engine_folders:
-        for file in os.listdir(folder):
+        engine = os.path.basename(folder)
+        for file in sorted(os.listdir(folder)):
             file_path = os.path.join(folder, file)
             try:
+                if len(kept) >= room:
+                    os.remove(file_path)
+                    continue
+                # hash outside the index lock so topics merge in parallel
                 h = file_hash(file_path)
-                if h not in seen_hashes:
-                    seen_hashes.add(h)
-                    ext = file.split(".")[-1].lower()
-                    new_name = os.path.join(final_dir, f"{count}.{ext}")
-                    os.rename(file_path, new_name)
-                    count += 1
+                phash = dhash(file_path) if index.near_duplicate_threshold is not None else None
+                ext = file.split(".")[-1].lower()
+                new_name = f"{next_number}.{ext}"
+                new_path = os.path.join(final_dir, new_name)
+                if index.add_if_new(h, phash, new_path):
+                    os.rename(file_path, new_path)
+                    index.record_file(new_path, h)
+                    kept.append((new_name, h, engine))
+                    next_number += 1
                 else:
                     os.remove(file_path)
             except Exception:
                 pass
 
-    # trim extra images if more than needed
-    all_images = sorted(os.listdir(final_dir), key=lambda x: int(x.split(".")[0]))
-    if len(all_images) > quantity:
-        for extra in all_images[quantity:]:
-            os.remove(os.path.join(final_dir, extra))
-
-    return len(os.listdir(final_dir))
+    return kept
+
+
+def merge_and_deduplicate(query, quantity, engine_folders, near_duplicate_threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+                          index=None):
+    """Merge engine folders, dropping exact copies and (unless threshold is None) near-duplicates
+    of anything already downloaded."""
+    index = index or HashIndex(DEFAULT_HASH_INDEX, near_duplicate_threshold)
+    return len(merge_files(query, quantity, engine_folders, index))
+
+
+def read_topics(path):
+    """Parse a topics file: one "topic, count" per line, blank lines and # comments ignored."""
+    topics = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            topic, sep, count = line.rpartition(",")
+            if not sep or not count.strip().isdigit() or not topic.strip():
+                raise ValueError(f"{path}:{line_no}: expected 'topic, count', got {line!r}")
+            topics.append((safe_folder_name(topic), int(count)))
+    return topics
+
+
+def run_batch(topics, workers=BATCH_WORKERS, engine_limit=BATCH_ENGINE_LIMIT,
+              near_duplicate_threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD, manifest_path=None, index=None):
+    """Scrape every (topic, count) on a bounded pool, deduplicate across the dataset, write a manifest."""
+    index = index or HashIndex(DEFAULT_HASH_INDEX, near_duplicate_threshold)
+    # each engine queues on its own pool, so a busy engine never holds threads the other could use
+    engine_pools = {engine: ThreadPoolExecutor(max_workers=min(engine_limit, workers), thread_name_prefix=engine)
+                    for engine in ENGINES}
+    crawl_slots = BoundedSemaphore(workers)
+    manifest_path = manifest_path or os.path.join(SAVE_DIR, MANIFEST_NAME)
+    results = []
+    started = time.time()
+
+    def crawl(topic, count, engine):
+        with crawl_slots:
+            return scrape_images(topic, count, engine)
+
+    def run_topic(topic, count):
+        # engines for one topic run side by side under the global and per-engine caps
+        t0 = time.time()
+        folders = [f.result() for f in [engine_pools[e].submit(crawl, topic, count, e) for e in ENGINES]]
+        kept = merge_files(topic, count, folders, index)
+        return {
+            "topic": topic,
+            "requested": count,
+            "saved": len(kept),
+            "folder": os.path.join(SAVE_DIR, topic),
+            "seconds": round(time.time() - t0, 2),
+            "files": [{"file": name, "md5": h, "engine": engine} for name, h, engine in kept],
+        }
+
+    # crawl workers are separate from topic coordinators so coordinators never starve them
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as topic_pool:
+            futures = {topic_pool.submit(run_topic, topic, count): topic for topic, count in topics}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"topic": futures[future], "requested": 0, "saved": 0, "seconds": 0, "files": [],
+                              "error": str(e)}
+                result["images_per_second"] = (round(result["saved"] / result["seconds"], 2)
+                                               if result["seconds"] else 0.0)
+                results.append(result)
+                status = "❌" if "error" in result else "✅"
+                print(f"[{done}/{len(topics)}] {status} {result['topic']}: {result['saved']}/{result['requested']} "
+                      f"images in {result['seconds']}s ({result['images_per_second']} img/s)", flush=True)
+    finally:
+        for pool in engine_pools.values():
+            pool.shutdown()
+
+    elapsed = time.time() - started
+    manifest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "near_duplicate_threshold": near_duplicate_threshold,
+        "seconds": round(elapsed, 2),
+        "images": sum(r["saved"] for r in results),
+        "topics": sorted(results, key=lambda r: r["topic"]),
+    }
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def print_summary(manifest):
+    print("\n📊 Summary")
+    print(f"{'topic':<30} {'saved':>11} {'seconds':>8} {'img/s':>7}")
+    for r in manifest["topics"]:
+        print(f"{r['topic'][:30]:<30} {str(r['saved']) + '/' + str(r['requested']):>11} "
+              f"{r['seconds']:>8} {r['images_per_second']:>7}")
+    rate = manifest["images"] / manifest["seconds"] if manifest["seconds"] else 0
+    print(f"✅ {manifest['images']} unique images across {len(manifest['topics'])} topics "
+          f"in {manifest['seconds']}s ({rate:.2f} img/s)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape images from Bing and Google.")
+    parser.add_argument("--batch", metavar="TOPICS_FILE",
+                        help="file with one 'topic, count' per line (omit for interactive mode)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                        help=f"crawls running at once across the batch (default {BATCH_WORKERS})")
+    parser.add_argument("--engine-limit", type=int, default=BATCH_ENGINE_LIMIT,
+                        help=f"crawls running at once per engine (default {BATCH_ENGINE_LIMIT})")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+                        help="near-duplicate Hamming threshold, -1 for exact duplicates only")
+    parser.add_argument("--manifest", help=f"manifest path (default {SAVE_DIR}/{MANIFEST_NAME})")
+    parser.add_argument("--index", default=DEFAULT_HASH_INDEX,
+                        help=f"persistent hash index (default {DEFAULT_HASH_INDEX}, or $IMAGE_HASH_INDEX)")
+    parser.add_argument("--reindex", action="store_true",
+                        help=f"first index files added to {SAVE_DIR}/ by other tools (only changed files are hashed)")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    threshold = None if args.threshold < 0 else args.threshold
+    index = HashIndex(args.index, threshold)
+    if args.reindex:
+        seen, hashed = index.scan(SAVE_DIR, file_hash)
+        print(f"🔎 Indexed {SAVE_DIR}/: {seen} files, {hashed} new or changed")
+    if args.batch:
+        manifest = run_batch(read_topics(args.batch), max(args.workers, 1), max(args.engine_limit, 1),
+                             threshold, args.manifest, index)
+        print_summary(manifest)
+        print(f"📂 Manifest: {args.manifest or os.path.join(SAVE_DIR, MANIFEST_NAME)}")
+        sys.exit(0)
+
     topic = input("Enter topic: ")
     quantity = int(input("Enter number of images: "))
     topic = safe_folder_name(topic)
@@ -86,7 +237,7 @@ if __name__ == "__main__":
     t1.start(); t2.start()
     t1.join(); t2.join()
 
-    total = merge_and_deduplicate(topic, quantity, engine_folders)
+    total = merge_and_deduplicate(topic, quantity, engine_folders, threshold, index)
 
     print(f"✅ Downloaded {total}/{quantity} unique images for '{topic}'")
     print(f"📂 Saved in: downloads/{topic}")
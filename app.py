@@ -1,90 +1,2042 @@
 import re
 import os
+import sys
 import hashlib
 import json
 import requests
 import zipfile
 import io
-import tempfile
 import time
 import shutil
 import threading
 import uuid
-from threading import Thread, Lock
+import sqlite3
+import struct
+import heapq
+import mimetypes
+from collections import OrderedDict, deque
+from threading import Thread, Lock, BoundedSemaphore, Condition
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 from urllib.parse import urlparse, urljoin
 from flask import Flask, render_template, request, jsonify, url_for, send_file, Response
+from requests.adapters import HTTPAdapter
+from werkzeug.middleware.proxy_fix import ProxyFix
 from icrawler.builtin import BingImageCrawler, GoogleImageCrawler
-from bs4 import BeautifulSoup
+from icrawler.downloader import ImageDownloader
+from icrawler.storage import BaseStorage
+from bs4 import BeautifulSoup, SoupStrainer
+from PIL import Image, features as pil_features
 import urllib.parse
+from dedup import HammingIndex, HashIndex, dhash, DEFAULT_NEAR_DUPLICATE_THRESHOLD
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'vercel-production-key-2024'
 
+# Proxies in front of the app (Vercel's edge) append the caller's address to X-Forwarded-For; only
+# that many trailing hops are trusted, since earlier ones are whatever the client sent (0 = no proxy)
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
 # Production-ready global variables
 progress_data = {}
 progress_lock = Lock()
 
+# Progress bus: SSE streams sleep on a per-session condition until the session changes
+progress_events = {}    # session_id -> [Condition on progress_lock, subscriber count]
+progress_versions = {}  # session_id -> change counter
+PROGRESS_HEARTBEAT = 15
+PROGRESS_UPDATE_INTERVAL = 0.25  # per-image updates are coalesced to at most one per interval per crawl
+PROGRESS_MAX_IMAGES = 50000      # result records kept for finished sessions before the oldest are dropped
+
+progress_results = OrderedDict()  # session_id -> result count, oldest published first
+progress_result_images = 0
+
+def publish_progress(session_id, fields):
+    """Merge fields into a session's progress and wake its subscribers (caller holds progress_lock)"""
+    progress_data.setdefault(session_id, {}).update(fields)
+    progress_versions[session_id] = progress_versions.get(session_id, 0) + 1
+    if session_id in progress_events:
+        progress_events[session_id][0].notify_all()
+    progress_backend.publish(session_id, progress_versions[session_id], progress_data[session_id])
+    if 'images' in fields:
+        track_progress_results(session_id, len(fields['images']))
+
+def track_progress_results(session_id, count):
+    """Count a session's results against the cap, dropping the oldest finished sessions over it
+    (caller holds progress_lock; their downloads stay available through the session index)"""
+    global progress_result_images
+    progress_result_images += count - progress_results.pop(session_id, 0)
+    progress_results[session_id] = count
+    while progress_result_images > PROGRESS_MAX_IMAGES and len(progress_results) > 1:
+        oldest, oldest_count = progress_results.popitem(last=False)
+        progress_result_images -= oldest_count
+        progress_data.pop(oldest, None)
+        progress_versions.pop(oldest, None)
+        progress_backend.drop(oldest)
+        if oldest in progress_events:
+            progress_events[oldest][0].notify_all()
+
+def forget_progress_results(session_id):
+    """Stop counting a session's results (caller holds progress_lock)"""
+    global progress_result_images
+    progress_result_images -= progress_results.pop(session_id, 0)
+
+def discard_progress(session_id):
+    """Forget a session whose job never started (caller holds progress_lock)"""
+    progress_data.pop(session_id, None)
+    progress_backend.drop(session_id)
+
+def progress_snapshot(session_id):
+    """Copy of a session's progress, from the shared backend if another worker runs it, or None"""
+    with progress_lock:
+        data = progress_data.get(session_id)
+        if data is not None:
+            return dict(data)
+    entry = progress_backend.load(session_id)
+    return entry[1] if entry else None
+
+def wait_for_shared_progress(session_id, version, timeout):
+    """Poll the shared backend until the session's version moves, returns (changed, version, data)"""
+    deadline = time.time() + timeout
+    while True:
+        current = progress_backend.version(session_id)
+        if current != version:
+            entry = progress_backend.load(session_id)
+            return True, entry[0] if entry else 0, entry[1] if entry else None
+        if time.time() >= deadline:
+            return False, current, None
+        time.sleep(PROGRESS_POLL_INTERVAL)
+
+# Progress backend: 'memory' keeps progress in this process, 'sqlite' shares it between the worker
+# processes of one host (gunicorn -w N) so any worker can answer /progress and /results
+PROGRESS_BACKEND = os.environ.get('PROGRESS_BACKEND', 'memory')
+PROGRESS_DB = os.environ.get('PROGRESS_DB', os.path.join('/tmp', 'progress.db'))  # Use /tmp for Vercel
+PROGRESS_POLL_INTERVAL = 0.25  # how often a stream checks on a job running in another worker
+
+class MemoryProgressBackend:
+    """No sharing: progress_data is the only copy. Shared backends implement the same methods
+    (a Redis adapter would keep a hash per session with a version field, and expire keys)"""
+    
+    shared = False
+    
+    def publish(self, session_id, version, data):
+        """Store a session's merged progress at a new version (caller holds progress_lock)"""
+    
+    def version(self, session_id):
+        """Current version of a session, 0 if unknown (cheap, polled by streams)"""
+        return 0
+    
+    def load(self, session_id):
+        """(version, progress) of a session, or None"""
+        return None
+    
+    def drop(self, session_id):
+        pass
+    
+    def sessions(self):
+        """[(session_id, progress)] of every stored session"""
+        return []
+    
+    def expire(self, max_age):
+        """Drop sessions not updated for max_age seconds (left by dead workers), returns the count"""
+        return 0
+
+class SQLiteProgressBackend(MemoryProgressBackend):
+    """Progress mirrored to SQLite for worker processes on the same host; publishes are queued and
+    written in batches by one thread, so progress_lock is never held across a database write"""
+    
+    shared = True
+    
+    def __init__(self, db_path=PROGRESS_DB):
+        self.db_path = db_path
+        self.lock = Lock()  # one connection, shared by the writer and readers
+        self.pending = {}   # session_id -> (version, progress) to write, None to delete
+        self.pending_changed = Condition()
+        self.writer = None
+        self.conn = None
+        self.init_db()
+    
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    def init_db(self):
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self.conn = self.connect()
+            with self.conn:
+                self.conn.execute('''CREATE TABLE IF NOT EXISTS progress (
+                    session_id TEXT PRIMARY KEY, version INTEGER, data TEXT, updated REAL)''')
+        except sqlite3.Error as e:
+            print(f"Shared progress store unavailable: {e}")
+    
+    @staticmethod
+    def decode(payload):
+        data = json.loads(payload)
+        if 'images' in data:
+            data['images'] = [ImageRecord.from_dict(img) for img in data['images']]
+        return data
+    
+    def queue(self, session_id, entry):
+        """Hand a write to the writer thread; a session's later writes replace its queued one"""
+        with self.pending_changed:
+            self.pending[session_id] = entry
+            self.pending_changed.notify()
+            if self.writer is None:
+                self.writer = Thread(target=self.write_pending, daemon=True)
+                self.writer.start()
+    
+    def publish(self, session_id, version, data):
+        self.queue(session_id, (version, dict(data)))
+    
+    def write_pending(self):
+        while True:
+            with self.pending_changed:
+                while not self.pending:
+                    self.pending_changed.wait()
+                batch, self.pending = self.pending, {}
+            if self.conn is None:
+                continue
+            now = time.time()
+            rows, dropped = [], []
+            for session_id, entry in batch.items():
+                if entry is None:
+                    dropped.append((session_id,))
+                else:
+                    version, data = entry
+                    rows.append((session_id, version, json.dumps(data, default=ImageRecord.to_dict), now))
+            try:
+                with self.lock, self.conn:
+                    self.conn.executemany('INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?)', rows)
+                    self.conn.executemany('DELETE FROM progress WHERE session_id = ?', dropped)
+            except Exception as e:
+                print(f"Shared progress write failed: {e}")
+    
+    def query(self, sql, args=()):
+        """Rows of a read, [] if the store is unavailable"""
+        if self.conn is None:
+            return []
+        try:
+            with self.lock:
+                return self.conn.execute(sql, args).fetchall()
+        except sqlite3.Error:
+            return []
+    
+    def version(self, session_id):
+        rows = self.query('SELECT version FROM progress WHERE session_id = ?', (session_id,))
+        return rows[0][0] if rows else 0
+    
+    def load(self, session_id):
+        rows = self.query('SELECT version, data FROM progress WHERE session_id = ?', (session_id,))
+        return (rows[0][0], self.decode(rows[0][1])) if rows else None
+    
+    def drop(self, session_id):
+        self.queue(session_id, None)
+    
+    def sessions(self):
+        return [(session_id, self.decode(data))
+                for session_id, data in self.query('SELECT session_id, data FROM progress')]
+    
+    def expire(self, max_age):
+        if self.conn is None:
+            return 0
+        try:
+            with self.lock, self.conn:
+                return self.conn.execute('DELETE FROM progress WHERE updated < ?',
+                                         (time.time() - max_age,)).rowcount
+        except sqlite3.Error:
+            return 0
+
+PROGRESS_BACKENDS = {'memory': MemoryProgressBackend, 'sqlite': SQLiteProgressBackend}
+
+def make_progress_backend(name):
+    if name not in PROGRESS_BACKENDS:
+        raise ValueError(f"Unknown PROGRESS_BACKEND {name!r}, expected one of: {', '.join(PROGRESS_BACKENDS)}")
+    return PROGRESS_BACKENDS[name]()
+
+progress_backend = make_progress_backend(PROGRESS_BACKEND)
+
+# Download engine limits (shared by every session on this worker)
+DOWNLOAD_MAX_WORKERS = 16
+DOWNLOAD_PER_HOST_LIMIT = 4
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Download validation, applied before the body is read or written where possible
+MAX_IMAGE_BYTES = 5 * 1024 * 1024  # 5MB for Vercel
+MIN_IMAGE_BYTES = 3000
+MIN_IMAGE_DIMENSIONS = (100, 100)  # smaller images are icons and spacers; (0, 0) disables
+SNIFF_MIN_BYTES = 32               # enough to recognise any supported signature
+SNIFF_MAX_BYTES = 256 * 1024       # give up on finding dimensions past this (large EXIF blocks)
+SNIFF_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream')
+
+def jpeg_dimensions(head):
+    """(width, height) from the first SOF marker, or None if it isn't in head"""
+    i = 2
+    while i + 9 <= len(head):
+        if head[i] != 0xFF:
+            return None
+        marker = head[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # markers without a length
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', head[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack('>H', head[i + 2:i + 4])[0]
+    return None
+
+def webp_dimensions(head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and len(head) >= 30:
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(head) >= 30:
+        return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+    return None
+
+def sniff_image(head):
+    """Real format and (width, height) from an image's first bytes, without decoding;
+    returns (extension, dimensions or None if not in head yet), or (None, None)"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg', jpeg_dimensions(head)
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png', struct.unpack('>II', head[16:24]) if len(head) >= 24 else None
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return '.gif', struct.unpack('<HH', head[6:10]) if len(head) >= 10 else None
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp', webp_dimensions(head)
+    return None, None
+
+def too_small(dimensions):
+    return dimensions is not None and (dimensions[0] < MIN_IMAGE_DIMENSIONS[0] or
+                                       dimensions[1] < MIN_IMAGE_DIMENSIONS[1])
+
+class DownloadEngine:
+    """Bounded download pool with keep-alive connection reuse and per-host limits"""
+    
+    def __init__(self, max_workers=DOWNLOAD_MAX_WORKERS, per_host_limit=DOWNLOAD_PER_HOST_LIMIT):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download')
+        self.host_slots = {}
+        self.host_lock = Lock()
+        
+        # One session so connections to the same host are kept alive and reused
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        })
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=per_host_limit, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def host_slot(self, url):
+        """Semaphore limiting concurrent downloads from the host of url"""
+        host = urlparse(url).netloc.lower()
+        with self.host_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = BoundedSemaphore(self.per_host_limit)
+            return self.host_slots[host]
+    
+    def acquire_host(self, url, should_stop=None):
+        """Take a per-host slot before queueing a download, so pool threads never wait on a busy host;
+        returns the slot, or None if should_stop() turns true first"""
+        slot = self.host_slot(url)
+        while not slot.acquire(timeout=0.5):
+            if should_stop and should_stop():
+                return None
+        return slot
+    
+    def submit(self, fn, *args, **kwargs):
+        """Queue a download task on the shared pool"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+download_engine = DownloadEngine()
+
+# Adaptive per-engine concurrency (AIMD on download latency and failures)
+ENGINE_INITIAL_CONCURRENCY = 2
+ENGINE_MIN_CONCURRENCY = 1
+ENGINE_MAX_CONCURRENCY = 8
+ENGINE_TARGET_LATENCY = 3.0  # seconds; slower downloads count as congestion
+ENGINE_BACKOFF_COOLDOWN = 1.0  # at most one multiplicative decrease per cooldown
+
+class AdaptiveConcurrency:
+    """Thread-safe AIMD limit: +1 per window of fast successes, halved on failures or slow downloads"""
+    
+    def __init__(self, initial=ENGINE_INITIAL_CONCURRENCY, minimum=ENGINE_MIN_CONCURRENCY,
+                 maximum=ENGINE_MAX_CONCURRENCY, target_latency=ENGINE_TARGET_LATENCY,
+                 cooldown=ENGINE_BACKOFF_COOLDOWN):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.limit = float(initial)
+        self.active = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_backoff = 0.0
+        self.condition = Condition()
+    
+    def acquire(self, should_stop=None):
+        """Wait for a slot under the current limit, returns False if should_stop() turns true first"""
+        with self.condition:
+            while self.active >= int(self.limit):
+                if should_stop and should_stop():
+                    return False
+                self.condition.wait(0.5)
+            self.active += 1
+            return True
+    
+    def release(self, latency=None, ok=True):
+        """Free a slot and adapt the limit (latency None releases without a sample)"""
+        with self.condition:
+            self.active = max(self.active - 1, 0)
+            if latency is not None:
+                if ok and latency <= self.target_latency:
+                    self.successes += 1
+                    self.limit = min(self.limit + 1.0 / self.limit, self.maximum)
+                else:
+                    self.failures += 1
+                    now = time.time()
+                    if now - self.last_backoff >= self.cooldown:
+                        self.limit = max(self.limit / 2, self.minimum)
+                        self.last_backoff = now
+            self.condition.notify_all()
+    
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': int(self.limit),
+                'active': self.active,
+                'successes': self.successes,
+                'failures': self.failures
+            }
+
+class SearchEngine:
+    """Engine plugin: search() returns image URLs, downloads run under the engine's adaptive limit"""
+    
+    name = None
+    enabled = True  # part of the default engine set when a request names none
+    
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or AdaptiveConcurrency()
+    
+    def search(self, scraper, query, max_images):
+        raise NotImplementedError
+    
+    def pages(self, scraper, query, max_images):
+        """Yield lists of image URLs, one per results page (paginated engines override this)"""
+        yield self.search(scraper, query, max_images)
+    
+    def run(self, scraper, query, images_per_engine, total_target):
+        """Search and download into scraper (URL engines share the download pool)"""
+        scraper.scrape_custom_engine_threaded(self, query, images_per_engine, total_target)
+
+class IcrawlerEngine(SearchEngine):
+    """Engine backed by an icrawler crawler, which searches and downloads on its own threads"""
+    
+    def __init__(self, name, crawler_class, concurrency=None):
+        super().__init__(concurrency)
+        self.name = name
+        self.crawler_class = crawler_class
+    
+    def run(self, scraper, query, images_per_engine, total_target):
+        scraper.scrape_engine_threaded(self, query, images_per_engine, total_target)
+
+class YandexEngine(SearchEngine):
+    name = 'yandex'
+    
+    def search(self, scraper, query, max_images):
+        return scraper.scrape_yandex_images(query, max_images)
+    
+    def pages(self, scraper, query, max_images):
+        return scraper.yandex_result_pages(query)
+
+class DuckDuckGoEngine(SearchEngine):
+    name = 'duckduckgo'
+    
+    def search(self, scraper, query, max_images):
+        return scraper.scrape_duckduckgo_images(query, max_images)
+    
+    def pages(self, scraper, query, max_images):
+        return scraper.duckduckgo_result_pages(query)
+
+ENGINE_REGISTRY = OrderedDict()  # engine name -> SearchEngine
+
+def register_engine(engine):
+    """Add (or replace) an engine plugin"""
+    ENGINE_REGISTRY[engine.name] = engine
+    return engine
+
+register_engine(IcrawlerEngine('bing', BingImageCrawler))
+register_engine(IcrawlerEngine('google', GoogleImageCrawler))
+register_engine(YandexEngine())
+register_engine(DuckDuckGoEngine())
+
+def default_engines():
+    return tuple(name for name, engine in ENGINE_REGISTRY.items() if engine.enabled)
+
+def resolve_engines(names):
+    """Validate requested engine names, returns the default set if none were given"""
+    if not names:
+        return default_engines()
+    unknown = [name for name in names if name not in ENGINE_REGISTRY]
+    if unknown:
+        raise ValueError(f"Unknown engine(s): {', '.join(unknown)}")
+    # Registry order, without repeats, so equal sets share cache entries and crawls
+    return tuple(name for name in ENGINE_REGISTRY if name in names)
+
+# Search result pages: fetched one at a time, parsed selectively, briefly cached
+SEARCH_PAGE_CACHE_TTL = 2 * 60
+SEARCH_PAGE_CACHE_MAX_ENTRIES = 256
+SEARCH_MAX_PAGES = 5
+SEARCH_TIMEOUT = 8
+DUCKDUCKGO_PAGE_SIZE = 100  # results per i.js page
+try:
+    import lxml  # noqa: F401 (optional, several times faster than html.parser)
+    SEARCH_HTML_PARSER = 'lxml'
+except ImportError:
+    SEARCH_HTML_PARSER = 'html.parser'
+
+def image_urls_from_html(html, base_url, css_class=None):
+    """Absolute src URLs of the <img> tags in a results page, building only those tags"""
+    soup = BeautifulSoup(html, SEARCH_HTML_PARSER, parse_only=SoupStrainer('img'))
+    urls = []
+    for img in soup.find_all('img', class_=css_class):
+        img_url = img.get('src', '')
+        if img_url.startswith('//'):
+            img_url = 'https:' + img_url
+        elif img_url.startswith('/'):
+            img_url = base_url + img_url
+        if img_url.startswith('http'):
+            urls.append(img_url)
+    return urls
+
+def parse_yandex_page(html):
+    return image_urls_from_html(html, 'https://yandex.com', 'serp-item__thumb')
+
+def parse_duckduckgo_page(html):
+    """(image URLs, vqd token for the i.js result pages or None)"""
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', 'replace')
+    urls = [url for url in image_urls_from_html(html, 'https://duckduckgo.com') if 'logo' not in url.lower()]
+    token = re.search(r'vqd=["\']?([\d-]+)', html)
+    return urls, token.group(1) if token else None
+
+class SearchPageCache:
+    """Short-lived in-memory cache of parsed result pages, keyed by engine, query and page"""
+    
+    def __init__(self, ttl=SEARCH_PAGE_CACHE_TTL, max_entries=SEARCH_PAGE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.entries = OrderedDict()  # (engine, query, page) -> (created, parsed page)
+        self.hits = 0
+        self.misses = 0
+    
+    def get_or_fetch(self, engine_name, query, page, fetch):
+        """Cached parsed page, or fetch() it (outside the lock) and cache the result"""
+        key = (engine_name, ' '.join(query.lower().split()), page)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        
+        value = fetch()
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+    
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+search_page_cache = SearchPageCache()
+
+# Per-engine instrumentation (exported at /metrics, summarized per session)
+METRIC_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DOWNLOAD_OUTCOMES = ('success', 'duplicate', 'too_small', 'rejected', 'error')
+
+class Histogram:
+    """Fixed-bucket latency histogram (not locked, owned by EngineMetrics)"""
+    
+    def __init__(self, buckets=METRIC_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+    
+    def cumulative(self):
+        """(le, count) pairs in Prometheus order"""
+        total = 0
+        pairs = []
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+    
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+class EngineMetrics:
+    """Thread-safe per-engine search/download latency, outcome and byte counters"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.engines = {}
+    
+    def _engine(self, engine_name):
+        stats = self.engines.get(engine_name)
+        if stats is None:
+            stats = self.engines[engine_name] = {
+                'searches': 0,
+                'search_errors': 0,
+                'search_seconds': Histogram(),
+                'download_seconds': Histogram(),
+                'downloads': dict.fromkeys(DOWNLOAD_OUTCOMES, 0),
+                'bytes': 0,
+                'run_seconds': 0.0
+            }
+        return stats
+    
+    def observe_search(self, engine_name, seconds, ok=True):
+        with self.lock:
+            stats = self._engine(engine_name)
+            stats['searches'] += 1
+            stats['search_seconds'].observe(seconds)
+            if not ok:
+                stats['search_errors'] += 1
+    
+    def observe_download(self, engine_name, outcome=None, size=0, seconds=None):
+        """Count a download outcome and/or its latency (either may be recorded separately)"""
+        with self.lock:
+            stats = self._engine(engine_name)
+            if outcome:
+                stats['downloads'][outcome] += 1
+            stats['bytes'] += size
+            if seconds is not None:
+                stats['download_seconds'].observe(seconds)
+    
+    def observe_run(self, engine_name, seconds):
+        with self.lock:
+            self._engine(engine_name)['run_seconds'] += seconds
+    
+    def summary(self):
+        """Plain dict per engine, suitable for JSON progress data"""
+        with self.lock:
+            result = {}
+            for engine_name, stats in self.engines.items():
+                images = stats['downloads']['success']
+                result[engine_name] = {
+                    'searches': stats['searches'],
+                    'search_errors': stats['search_errors'],
+                    'search_seconds': round(stats['search_seconds'].mean(), 3),
+                    'download_seconds': round(stats['download_seconds'].mean(), 3),
+                    'downloads': dict(stats['downloads']),
+                    'bytes': stats['bytes'],
+                    'images_per_second': round(images / stats['run_seconds'], 2) if stats['run_seconds'] else 0.0
+                }
+            return result
+    
+    def render_prometheus(self):
+        """Prometheus text exposition of every engine's metrics"""
+        with self.lock:
+            engines = self.engines
+            lines = []
+            
+            def family(name, kind, help_text):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            
+            def histogram(name, key, help_text):
+                family(name, 'histogram', help_text)
+                for engine_name, stats in engines.items():
+                    hist = stats[key]
+                    for bound, count in hist.cumulative():
+                        lines.append(f'{name}_bucket{{engine="{engine_name}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{engine="{engine_name}"}} {hist.sum:.6f}')
+                    lines.append(f'{name}_count{{engine="{engine_name}"}} {hist.count}')
+            
+            family('image_scraper_engine_searches_total', 'counter', 'Searches run per engine')
+            for engine_name, stats in engines.items():
+                lines.append(f'image_scraper_engine_searches_total{{engine="{engine_name}"}} {stats["searches"]}')
+            family('image_scraper_engine_search_errors_total', 'counter', 'Searches or crawls that failed')
+            for engine_name, stats in engines.items():
+                lines.append(f'image_scraper_engine_search_errors_total{{engine="{engine_name}"}} {stats["search_errors"]}')
+            histogram('image_scraper_engine_search_seconds', 'search_seconds', 'Search request latency')
+            histogram('image_scraper_engine_download_seconds', 'download_seconds', 'Image download latency')
+            family('image_scraper_engine_downloads_total', 'counter', 'Downloads by outcome')
+            for engine_name, stats in engines.items():
+                for outcome, count in stats['downloads'].items():
+                    lines.append(f'image_scraper_engine_downloads_total{{engine="{engine_name}",outcome="{outcome}"}} {count}')
+            family('image_scraper_engine_bytes_total', 'counter', 'Image bytes downloaded')
+            for engine_name, stats in engines.items():
+                lines.append(f'image_scraper_engine_bytes_total{{engine="{engine_name}"}} {stats["bytes"]}')
+            family('image_scraper_engine_images_per_second', 'gauge', 'Accepted images per second of engine run time')
+            for engine_name, stats in engines.items():
+                rate = stats['downloads']['success'] / stats['run_seconds'] if stats['run_seconds'] else 0.0
+                lines.append(f'image_scraper_engine_images_per_second{{engine="{engine_name}"}} {rate:.4f}')
+        
+        family('image_scraper_engine_concurrency_limit', 'gauge', 'Current adaptive download concurrency')
+        for engine_name, engine in ENGINE_REGISTRY.items():
+            lines.append(f'image_scraper_engine_concurrency_limit{{engine="{engine_name}"}} {engine.concurrency.stats()["limit"]}')
+        return '\n'.join(lines) + '\n'
+
+class ImageRejected(Exception):
+    """A download that completed but failed the size or content filters"""
+    
+    def __init__(self, reason, size=0):
+        super().__init__(reason)
+        self.reason = reason
+        self.size = size
+
+engine_metrics = EngineMetrics()  # process-wide totals
+
+# Content-addressed image store shared by every session
+BLOB_STORE_DIR = os.environ.get('IMAGE_STORE_DIR', os.path.join('/tmp', 'image_store'))  # Use /tmp for Vercel
+BLOB_GC_INTERVAL = 60
+BLOB_NAME_PATTERN = re.compile(r'^[0-9a-f]{32}\.[a-z0-9]+$')
+BLOB_GC_GRACE = 300  # unreferenced blobs younger than this are kept for late acquirers
+BLOB_EVICT_MIN_AGE = 30  # over the disk budget, only unreferenced blobs this young are spared
+BLOB_REFS_DB = os.environ.get('IMAGE_STORE_DB', os.path.join('/tmp', 'image_store.db'))  # references shared by workers
+TEMP_STORAGE_BUDGET = int(os.environ.get('TEMP_STORAGE_BUDGET', 1024 * 1024 * 1024))  # image bytes kept in /tmp
+THUMBNAIL_MAX_SIZE = (320, 320)  # previews for the results grid, stored next to their blobs
+THUMBNAIL_FORMAT = 'WEBP' if pil_features.check('webp') else 'JPEG'
+THUMBNAIL_SUFFIX = '.thumb.webp' if THUMBNAIL_FORMAT == 'WEBP' else '.thumb.jpg'
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_WORKERS = 2
+
+class BlobStore:
+    """Images keyed by content hash, fanned out by prefix, reference counted per owner"""
+    
+    def __init__(self, root=BLOB_STORE_DIR, gc_grace=BLOB_GC_GRACE):
+        self.root = root
+        self.gc_grace = gc_grace
+        self.lock = Lock()
+        self.refs = {}       # blob name -> set of owners (session ids, cache keys)
+        self.owners = {}     # owner -> set of blob names
+        self.sizes = {}      # blob name -> bytes on disk, its thumbnail included
+        self.last_used = {}  # blob name -> time it was last stored or acquired
+        self.total_bytes = 0
+        self.load_existing()
+    
+    @staticmethod
+    def blob_name(img_hash, file_ext):
+        return f"{img_hash}{file_ext.lower()}"
+    
+    def path_for(self, name):
+        """O(1) path of a blob name (no directory probing)"""
+        return os.path.join(self.root, name[:2], name[2:4], name)
+    
+    def is_blob_name(self, name):
+        return name in self.refs
+    
+    def load_existing(self):
+        """Register blobs left by a previous run so the collector can reclaim them"""
+        if not os.path.exists(self.root):
+            return
+        thumbnail_bytes = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.part'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                if filename.endswith(THUMBNAIL_SUFFIX):
+                    thumbnail_bytes[filename[:-len(THUMBNAIL_SUFFIX)]] = st.st_size
+                else:
+                    self.refs.setdefault(filename, set())
+                    self.sizes[filename] = st.st_size
+                    self.last_used[filename] = st.st_mtime
+        for name, size in thumbnail_bytes.items():
+            if name in self.sizes:
+                self.sizes[name] += size
+        self.total_bytes = sum(self.sizes.values())
+    
+    def put(self, src_path, img_hash, file_ext):
+        """Move src_path into the store (or drop it if the blob exists) and return the blob name"""
+        name = self.blob_name(img_hash, file_ext)
+        dest_path = self.path_for(name)
+        with self.lock:
+            if os.path.exists(dest_path):
+                os.remove(src_path)
+                os.utime(dest_path)  # restart the grace period for the collector
+            else:
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                shutil.move(src_path, dest_path)
+            self.refs.setdefault(name, set())
+            if name not in self.sizes:
+                self.sizes[name] = os.path.getsize(dest_path)
+                self.total_bytes += self.sizes[name]
+            self.last_used[name] = time.time()
+        storage_reaper.start()
+        return name
+    
+    def acquire(self, name, owner):
+        with self.lock:
+            self.refs.setdefault(name, set()).add(owner)
+            self.owners.setdefault(owner, set()).add(name)
+            self.last_used[name] = time.time()
+    
+    def account(self, name, size):
+        """Charge extra bytes stored for a blob (its thumbnail) to the disk budget"""
+        with self.lock:
+            if name in self.sizes:
+                self.sizes[name] += size
+                self.total_bytes += size
+    
+    def release(self, owner):
+        """Drop every reference held by owner; files go when the collector runs"""
+        with self.lock:
+            for name in self.owners.pop(owner, ()):
+                if name in self.refs:
+                    self.refs[name].discard(owner)
+    
+    def collect(self, grace=None):
+        """Delete unreferenced blobs older than the grace period, returns the count removed"""
+        grace = self.gc_grace if grace is None else grace
+        now = time.time()
+        removed = 0
+        with self.lock:
+            for name in [n for n, owners in self.refs.items() if not owners]:
+                try:
+                    if now - os.path.getmtime(self.path_for(name)) < grace:
+                        continue
+                except FileNotFoundError:
+                    pass
+                if self.remove(name):
+                    removed += 1
+        return removed
+    
+    def evict_lru(self, max_bytes, min_age=BLOB_EVICT_MIN_AGE):
+        """Delete unreferenced blobs, least recently used first, until the store fits in
+        max_bytes; returns the bytes freed"""
+        freed = 0
+        with self.lock:
+            if self.total_bytes <= max_bytes:
+                return 0
+            now = time.time()
+            idle = sorted((self.last_used.get(n, 0), n) for n, owners in self.refs.items() if not owners)
+            for last_used, name in idle:
+                if self.total_bytes <= max_bytes or now - last_used < min_age:
+                    break
+                size = self.sizes.get(name, 0)
+                if self.remove(name):
+                    freed += size
+        return freed
+    
+    def delete_files(self, name):
+        """Delete a blob's file and thumbnail, returns False on failure"""
+        path = self.path_for(name)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Blob GC error for {name}: {e}")
+            return False
+        try:
+            os.remove(path + THUMBNAIL_SUFFIX)
+        except FileNotFoundError:
+            pass
+        forget_image_file(name)
+        forget_image_file(ThumbnailPipeline.thumbnail_name(name))
+        return True
+    
+    def remove(self, name):
+        """Delete a blob and its thumbnail (caller holds the lock), returns False on failure"""
+        if not self.delete_files(name):
+            return False
+        del self.refs[name]
+        self.total_bytes -= self.sizes.pop(name, 0)
+        self.last_used.pop(name, None)
+        return True
+    
+    def clear(self):
+        """Remove every blob and reference, returns the count removed"""
+        with self.lock:
+            removed = len(self.refs)
+            self.refs.clear()
+            self.owners.clear()
+            self.sizes.clear()
+            self.last_used.clear()
+            self.total_bytes = 0
+            shutil.rmtree(self.root, ignore_errors=True)
+        return removed
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'blobs': len(self.refs),
+                'referenced': sum(1 for owners in self.refs.values() if owners),
+                'owners': len(self.owners),
+                'bytes': self.total_bytes
+            }
+
+class SQLiteBlobStore(BlobStore):
+    """Blob store whose references, sizes and last-used times live in SQLite, for worker processes
+    sharing BLOB_STORE_DIR: a blob is only collected once no owner in any worker holds it.
+    Writes that decide a blob's fate (put, collect, evict) take the database write lock, so a
+    worker never deletes a blob another is moving in"""
+    
+    def __init__(self, root=BLOB_STORE_DIR, gc_grace=BLOB_GC_GRACE, db_path=BLOB_REFS_DB):
+        self.root = root
+        self.gc_grace = gc_grace
+        self.db_path = db_path
+        self.lock = Lock()  # guards the connection within this process
+        self.pid = os.getpid()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                name TEXT PRIMARY KEY, size INTEGER, last_used REAL)''')
+            # pid lets a restarted worker drop the references a dead one never released
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS refs (
+                name TEXT, owner TEXT, pid INTEGER, PRIMARY KEY (name, owner, pid)) WITHOUT ROWID''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS refs_by_owner ON refs (owner)')
+        self.load_existing()
+    
+    def is_blob_name(self, name):
+        """Blobs stored by any worker qualify (no database read on the serving path)"""
+        return bool(BLOB_NAME_PATTERN.match(name)) and os.path.exists(self.path_for(name))
+    
+    def load_existing(self):
+        """Register blobs on disk no worker has recorded, and drop references of dead workers"""
+        self.release_dead_workers()
+        if not os.path.exists(self.root):
+            return
+        found = {}
+        thumbnail_bytes = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.part'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                if filename.endswith(THUMBNAIL_SUFFIX):
+                    thumbnail_bytes[filename[:-len(THUMBNAIL_SUFFIX)]] = st.st_size
+                else:
+                    found[filename] = [st.st_size, st.st_mtime]
+        for name, size in thumbnail_bytes.items():
+            if name in found:
+                found[name][0] += size
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)',
+                                  [(name, size, mtime) for name, (size, mtime) in found.items()])
+    
+    def release_dead_workers(self):
+        """Drop references held by worker processes that are gone, returns the count dropped"""
+        with self.lock:
+            pids = [row[0] for row in self.conn.execute('SELECT DISTINCT pid FROM refs')]
+        dead = []
+        for pid in pids:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                dead.append((pid,))
+            except OSError:
+                pass  # alive, owned by another user
+        if not dead:
+            return 0
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            return self.conn.executemany('DELETE FROM refs WHERE pid = ?', dead).rowcount
+    
+    def put(self, src_path, img_hash, file_ext):
+        name = self.blob_name(img_hash, file_ext)
+        dest_path = self.path_for(name)
+        size = os.path.getsize(src_path)
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            # Bumping last_used restarts the grace period for every worker's collector
+            self.conn.execute('''INSERT INTO blobs VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET last_used = excluded.last_used''', (name, size, time.time()))
+            if os.path.exists(dest_path):
+                os.remove(src_path)
+            else:
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                shutil.move(src_path, dest_path)
+        storage_reaper.start()
+        return name
+    
+    def acquire(self, name, owner):
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('INSERT OR IGNORE INTO refs VALUES (?, ?, ?)', (name, owner, self.pid))
+            self.conn.execute('UPDATE blobs SET last_used = ? WHERE name = ?', (time.time(), name))
+    
+    def account(self, name, size):
+        with self.lock:
+            self.conn.execute('UPDATE blobs SET size = size + ? WHERE name = ?', (size, name))
+    
+    def release(self, owner):
+        with self.lock:
+            self.conn.execute('DELETE FROM refs WHERE owner = ?', (owner,))
+    
+    @property
+    def total_bytes(self):
+        with self.lock:
+            return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+    
+    def idle(self, older_than):
+        """(name, size) of unreferenced blobs last used before older_than, least recent first
+        (caller holds the lock)"""
+        return self.conn.execute('''SELECT name, size FROM blobs
+            WHERE last_used < ? AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.name = blobs.name)
+            ORDER BY last_used''', (older_than,)).fetchall()
+    
+    def collect(self, grace=None):
+        grace = self.gc_grace if grace is None else grace
+        self.release_dead_workers()
+        removed = 0
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for name, size in self.idle(time.time() - grace):
+                if self.remove(name):
+                    removed += 1
+        return removed
+    
+    def evict_lru(self, max_bytes, min_age=BLOB_EVICT_MIN_AGE):
+        freed = 0
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            for name, size in self.idle(time.time() - min_age):
+                if total <= max_bytes:
+                    break
+                if self.remove(name):
+                    total -= size
+                    freed += size
+        return freed
+    
+    def remove(self, name):
+        """Delete a blob and its thumbnail (caller holds the lock in a write transaction)"""
+        if not self.delete_files(name):
+            return False
+        self.conn.execute('DELETE FROM blobs WHERE name = ?', (name,))
+        return True
+    
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            removed = self.conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+            self.conn.execute('DELETE FROM refs')
+            self.conn.execute('DELETE FROM blobs')
+            shutil.rmtree(self.root, ignore_errors=True)
+        return removed
+    
+    def stats(self):
+        with self.lock:
+            blobs, total = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            referenced, owners = self.conn.execute(
+                'SELECT COUNT(DISTINCT name), COUNT(DISTINCT owner) FROM refs').fetchone()
+        return {'blobs': blobs, 'referenced': referenced, 'owners': owners, 'bytes': total}
+
+# Worker processes sharing progress (PROGRESS_BACKEND=sqlite) share the image store's references too
+blob_store = SQLiteBlobStore() if progress_backend.shared else BlobStore()
+
+class ThumbnailPipeline:
+    """Worker pool that writes a preview beside each accepted blob, deduplicating requests"""
+    
+    def __init__(self, workers=THUMBNAIL_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self.lock = Lock()
+        self.pending = {}  # blob name -> Future of the thumbnail path
+    
+    @staticmethod
+    def thumbnail_name(blob_name):
+        return f"{blob_name}{THUMBNAIL_SUFFIX}"
+    
+    @staticmethod
+    def blob_for(filename):
+        """Blob name a thumbnail name refers to, or None"""
+        return filename[:-len(THUMBNAIL_SUFFIX)] if filename.endswith(THUMBNAIL_SUFFIX) else None
+    
+    def submit(self, blob_name):
+        """Queue a thumbnail (no-op if one is already queued), returns its Future"""
+        with self.lock:
+            future = self.pending.get(blob_name)
+            if future is None:
+                future = self.pending[blob_name] = self.executor.submit(self.generate, blob_name)
+            return future
+    
+    def ensure(self, blob_name):
+        """Path of a blob's thumbnail, or None after queueing it if it isn't on disk yet
+        (never waits, so a backlog can't park request threads)"""
+        path = blob_store.path_for(blob_name) + THUMBNAIL_SUFFIX
+        if os.path.exists(path):
+            return path
+        self.submit(blob_name)
+        return None
+    
+    def generate(self, blob_name):
+        """Write the thumbnail for a blob, returns its path (None if the image can't be decoded)"""
+        src_path = blob_store.path_for(blob_name)
+        dest_path = src_path + THUMBNAIL_SUFFIX
+        part_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+        try:
+            if os.path.exists(dest_path):
+                return dest_path
+            with Image.open(src_path) as img:
+                # draft() lets JPEG decode straight at a reduced scale
+                img.draft('RGB', THUMBNAIL_MAX_SIZE)
+                img.thumbnail(THUMBNAIL_MAX_SIZE)
+                has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+                img = img.convert('RGBA' if has_alpha and THUMBNAIL_FORMAT == 'WEBP' else 'RGB')
+                # method=0 is WebP's fastest encoder; sizes are within a few percent at this scale
+                img.save(part_path, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, method=0)
+            os.replace(part_path, dest_path)
+            blob_store.account(blob_name, os.path.getsize(dest_path))
+            return dest_path
+        except Exception as e:
+            print(f"Thumbnail error for {blob_name}: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return None
+        finally:
+            with self.lock:
+                self.pending.pop(blob_name, None)
+
+thumbnails = ThumbnailPipeline()
+
+class ImageRecord:
+    """Compact accepted image: its blob name, interned engine and topic, and its number;
+    the URLs and paths every consumer reads are derived, so nothing is stored twice"""
+    
+    __slots__ = ('blob', 'engine', 'topic', 'number')
+    FIELDS = ('url', 'filename', 'engine', 'local_path', 'hash', 'blob', 'thumb', 'temp_path')
+    
+    def __init__(self, blob, engine, topic, number):
+        self.blob = blob
+        self.engine = sys.intern(engine)
+        self.topic = sys.intern(topic)
+        self.number = number
+    
+    @property
+    def hash(self):
+        return self.blob.split('.', 1)[0]
+    
+    @property
+    def url(self):
+        return f"/static/temp_images/{self.blob}"
+    
+    @property
+    def thumb(self):
+        return f"/static/temp_images/{ThumbnailPipeline.thumbnail_name(self.blob)}"
+    
+    @property
+    def filename(self):
+        return f"{self.topic}_{self.engine}_{self.number}{os.path.splitext(self.blob)[1]}"
+    
+    @property
+    def local_path(self):
+        return blob_store.path_for(self.blob)
+    
+    temp_path = local_path  # For Vercel cleanup
+    
+    # Read like the image dicts they replace (templates, caches, checkpoints)
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key):
+        return key in self.FIELDS
+    
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+    
+    def keys(self):
+        return self.FIELDS
+    
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+    
+    @classmethod
+    def from_dict(cls, image):
+        """Record for a serialized blob image, or the dict unchanged if it doesn't fit one"""
+        blob, engine = image.get('blob'), image.get('engine', '')
+        stem = os.path.splitext(image.get('filename', ''))[0]
+        prefix, _, number = stem.rpartition('_')
+        if not blob or not number.isdigit() or not prefix.endswith(f"_{engine}"):
+            return image
+        return cls(blob, engine, prefix[:-len(engine) - 1], int(number))
+
+# Query result cache limits
+QUERY_CACHE_DIR = os.environ.get('QUERY_CACHE_DIR', os.path.join('/tmp', 'url_cache'))  # Use /tmp for Vercel
+QUERY_CACHE_TTL = 60 * 60
+QUERY_CACHE_MAX_ENTRIES = 200
+QUERY_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+class QueryCache:
+    """Persistent cross-session cache of finished searches with TTL and LRU eviction"""
+    
+    def __init__(self, cache_dir=QUERY_CACHE_DIR, ttl=QUERY_CACHE_TTL,
+                 max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.entries = OrderedDict()  # key -> {'created', 'bytes', 'topic'}, least recently used first
+        self.load_index()
+    
+    @staticmethod
+    def make_key(topic, quantity, engines=None, near_duplicate_threshold=None, exclude_seen=False):
+        """Cache key from normalized topic, engine set and quantity"""
+        normalized = QueryCache.normalize_topic(topic)
+        parts = [normalized, sorted(engines or default_engines()), int(quantity), near_duplicate_threshold]
+        if exclude_seen:
+            parts.append('exclude_seen')
+        raw = json.dumps(parts)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    
+    def index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+    
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+    
+    @staticmethod
+    def normalize_topic(topic):
+        return ' '.join(topic.lower().split())
+    
+    def owner(self, key):
+        """Blob store reference holder for an entry"""
+        return f'cache:{key}'
+    
+    def load_index(self):
+        """Load the LRU order from disk so the cache survives restarts"""
+        try:
+            with open(self.index_path(), 'r') as f:
+                for key, meta in json.load(f):
+                    self.entries[key] = meta
+        except (OSError, ValueError):
+            pass
+        
+        # Re-take blob references so the collector keeps cached images
+        for key in self.entries:
+            try:
+                with open(self.entry_path(key), 'r') as f:
+                    for img in json.load(f):
+                        if img.get('blob'):
+                            blob_store.acquire(img['blob'], self.owner(key))
+            except (OSError, ValueError):
+                pass
+    
+    def save_index(self):
+        """Write the index atomically (caller holds the lock)"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self.index_path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(list(self.entries.items()), f)
+            os.replace(tmp_path, self.index_path())
+        except OSError as e:
+            print(f"Query cache index write failed: {e}")
+    
+    def get(self, key):
+        """Return cached images for key, or None on a miss"""
+        with self.lock:
+            meta = self.entries.get(key)
+            images = None
+            if meta and time.time() - meta['created'] < self.ttl:
+                try:
+                    with open(self.entry_path(key), 'r') as f:
+                        images = [ImageRecord.from_dict(img) for img in json.load(f)]
+                except (OSError, ValueError):
+                    images = None
+                # Files may have been cleared behind our back
+                if images and not all(os.path.exists(img.get('local_path', '')) for img in images):
+                    images = None
+            
+            if images is None:
+                if meta:
+                    self.remove_entry(key)
+                    self.save_index()
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += meta['bytes']
+            self.save_index()
+            return images
+    
+    def put(self, key, images, topic=''):
+        """Store a finished search and evict least recently used entries over budget"""
+        if not images:
+            return
+        total_bytes = 0
+        for img in images:
+            try:
+                total_bytes += os.path.getsize(img['local_path'])
+            except (OSError, KeyError):
+                pass
+        
+        with self.lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(self.entry_path(key), 'w') as f:
+                    json.dump(images, f, default=ImageRecord.to_dict)
+            except OSError as e:
+                print(f"Query cache write failed: {e}")
+                return
+            
+            self.entries.pop(key, None)
+            self.entries[key] = {'created': time.time(), 'bytes': total_bytes,
+                                 'topic': self.normalize_topic(topic)}
+            for img in images:
+                if img.get('blob'):
+                    blob_store.acquire(img['blob'], self.owner(key))
+            
+            while len(self.entries) > 1 and (
+                    len(self.entries) > self.max_entries or
+                    sum(meta['bytes'] for meta in self.entries.values()) > self.max_bytes):
+                self.remove_entry(next(iter(self.entries)), delete_files=True)
+            self.save_index()
+    
+    def remove_entry(self, key, delete_files=False):
+        """Drop an entry's metadata and optionally the image files it owns (caller holds the lock)"""
+        self.entries.pop(key, None)
+        path = self.entry_path(key)
+        # Shared blobs are freed by the collector once no session or entry references them
+        blob_store.release(self.owner(key))
+        if delete_files:
+            try:
+                with open(path, 'r') as f:
+                    for img in json.load(f):
+                        if not img.get('blob') and img.get('local_path') and os.path.exists(img['local_path']):
+                            os.remove(img['local_path'])
+            except (OSError, ValueError):
+                pass
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def expire(self):
+        """Drop entries past their TTL, returns the count removed"""
+        now = time.time()
+        with self.lock:
+            keys = [key for key, meta in self.entries.items() if now - meta['created'] >= self.ttl]
+            for key in keys:
+                self.remove_entry(key, delete_files=True)
+            if keys:
+                self.save_index()
+        return len(keys)
+    
+    def evict_oldest(self):
+        """Drop the least recently used entry, returns False if there is none"""
+        with self.lock:
+            if not self.entries:
+                return False
+            self.remove_entry(next(iter(self.entries)), delete_files=True)
+            self.save_index()
+        return True
+    
+    def clear_topic(self, topic):
+        """Forget cached searches for a topic, returns the count removed"""
+        normalized = self.normalize_topic(topic)
+        with self.lock:
+            keys = [key for key, meta in self.entries.items() if meta.get('topic') == normalized]
+            for key in keys:
+                self.remove_entry(key)
+            self.save_index()
+        return len(keys)
+    
+    def clear(self):
+        """Forget every cached search (image files are handled by the caller)"""
+        with self.lock:
+            for key in list(self.entries):
+                self.remove_entry(key)
+            self.save_index()
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes_cached': sum(meta['bytes'] for meta in self.entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'ttl_seconds': self.ttl,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes
+            }
+
+query_cache = QueryCache()
+
+# Session -> ordered result files, so download routes never scan directories
+SESSION_INDEX_DB = os.environ.get('SESSION_INDEX_DB', os.path.join('/tmp', 'session_index.db'))  # Use /tmp for Vercel
+SESSION_FILE_RETENTION = 60 * 60
+
+class SessionIndex:
+    """In-memory session/topic -> file list index backed by SQLite"""
+    
+    def __init__(self, db_path=SESSION_INDEX_DB):
+        self.db_path = db_path
+        self.lock = Lock()
+        self.sessions = {}      # session_id -> {'topic', 'safe_topic', 'files': [(name, download_name)]}
+        self.topic_latest = {}  # lowercased safe topic -> most recent session_id
+        self.init_db()
+    
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    def init_db(self):
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with self.connect() as conn:
+                conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY, topic TEXT, safe_topic TEXT, created REAL)''')
+                conn.execute('''CREATE TABLE IF NOT EXISTS session_files (
+                    session_id TEXT, position INTEGER, name TEXT, download_name TEXT,
+                    PRIMARY KEY (session_id, position))''')
+                conn.execute('CREATE INDEX IF NOT EXISTS sessions_by_topic ON sessions (safe_topic, created)')
+        except sqlite3.Error as e:
+            print(f"Session index unavailable: {e}")
+    
+    def record(self, session_id, topic, images):
+        """Remember the ordered result files of a finished session"""
+        safe_topic = safe_folder_name(topic)
+        files = []
+        for i, img in enumerate(images):
+            local_path = img.get('local_path') or img.get('temp_path') or ''
+            name = img.get('blob') or os.path.basename(local_path)
+            _, ext = os.path.splitext(name)
+            files.append((name, f"{safe_topic}_{i+1}{ext}"))
+        
+        entry = {'topic': topic, 'safe_topic': safe_topic, 'files': files}
+        with self.lock:
+            self.sessions[session_id] = entry
+            self.topic_latest[safe_topic.lower()] = session_id
+        
+        try:
+            with self.connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)',
+                             (session_id, topic, safe_topic.lower(), time.time()))
+                conn.execute('DELETE FROM session_files WHERE session_id = ?', (session_id,))
+                conn.executemany('INSERT INTO session_files VALUES (?, ?, ?, ?)',
+                                 [(session_id, i, name, download_name)
+                                  for i, (name, download_name) in enumerate(files)])
+        except sqlite3.Error as e:
+            print(f"Session index write failed: {e}")
+    
+    def load(self, session_id):
+        """Fetch a session recorded by another process or before a restart"""
+        try:
+            with self.connect() as conn:
+                row = conn.execute('SELECT topic FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+                if not row:
+                    return None
+                rows = conn.execute('SELECT name, download_name FROM session_files '
+                                    'WHERE session_id = ? ORDER BY position', (session_id,)).fetchall()
+        except sqlite3.Error:
+            return None
+        entry = {'topic': row[0], 'safe_topic': safe_folder_name(row[0]), 'files': [tuple(r) for r in rows]}
+        with self.lock:
+            self.sessions[session_id] = entry
+        return entry
+    
+    def get(self, session_id=None, topic=None):
+        """Entry for a session, or the most recent session for a topic"""
+        if not session_id and topic:
+            key = safe_folder_name(topic).lower()
+            with self.lock:
+                session_id = self.topic_latest.get(key)
+            if not session_id:
+                try:
+                    with self.connect() as conn:
+                        row = conn.execute('SELECT session_id FROM sessions WHERE safe_topic = ? '
+                                           'ORDER BY created DESC LIMIT 1', (key,)).fetchone()
+                    session_id = row[0] if row else None
+                except sqlite3.Error:
+                    session_id = None
+        if not session_id:
+            return None
+        with self.lock:
+            entry = self.sessions.get(session_id)
+        return entry or self.load(session_id)
+    
+    def sessions_for_topic(self, topic):
+        key = safe_folder_name(topic).lower()
+        try:
+            with self.connect() as conn:
+                return [r[0] for r in conn.execute('SELECT session_id FROM sessions WHERE safe_topic = ?', (key,))]
+        except sqlite3.Error:
+            with self.lock:
+                return [sid for sid, entry in self.sessions.items() if entry['safe_topic'].lower() == key]
+    
+    def forget(self, session_id):
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+            if entry and self.topic_latest.get(entry['safe_topic'].lower()) == session_id:
+                del self.topic_latest[entry['safe_topic'].lower()]
+        try:
+            with self.connect() as conn:
+                conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+                conn.execute('DELETE FROM session_files WHERE session_id = ?', (session_id,))
+        except sqlite3.Error:
+            pass
+    
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+            self.topic_latest.clear()
+        try:
+            with self.connect() as conn:
+                conn.execute('DELETE FROM sessions')
+                conn.execute('DELETE FROM session_files')
+        except sqlite3.Error:
+            pass
+
+session_index = SessionIndex()
+
+# Crawl checkpoints, so a job interrupted by a restart resumes instead of starting over
+JOB_CHECKPOINT_DB = os.environ.get('JOB_CHECKPOINT_DB', os.path.join('/tmp', 'job_checkpoints.db'))  # Use /tmp for Vercel
+JOB_CHECKPOINT_INTERVAL = 1.0  # seconds between flushes (also the running job's heartbeat)
+JOB_CHECKPOINT_STALE = 60      # a job without a heartbeat for this long is considered dead
+JOB_CHECKPOINT_TTL = 24 * 60 * 60
+
+class JobCheckpoints:
+    """SQLite record of each running crawl's accepted images and fetched URLs"""
+    
+    def __init__(self, db_path=JOB_CHECKPOINT_DB, stale=JOB_CHECKPOINT_STALE, ttl=JOB_CHECKPOINT_TTL):
+        self.db_path = db_path
+        self.stale = stale
+        self.ttl = ttl
+        self.init_db()
+        self.load_refs()
+    
+    @staticmethod
+    def owner(checkpoint_id):
+        return f"job:{checkpoint_id}"
+    
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    def init_db(self):
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with self.connect() as conn:
+                conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                    checkpoint_id TEXT PRIMARY KEY, session_id TEXT, cache_key TEXT, topic TEXT,
+                    quantity INTEGER, engines TEXT, threshold INTEGER, created REAL, updated REAL)''')
+                conn.execute('''CREATE TABLE IF NOT EXISTS job_images (
+                    checkpoint_id TEXT, hash TEXT, position INTEGER, data TEXT, phash TEXT,
+                    PRIMARY KEY (checkpoint_id, hash))''')
+                conn.execute('''CREATE TABLE IF NOT EXISTS job_urls (
+                    checkpoint_id TEXT, url TEXT, PRIMARY KEY (checkpoint_id, url))''')
+                try:
+                    conn.execute('ALTER TABLE jobs ADD COLUMN exclude_seen INTEGER DEFAULT 0')
+                except sqlite3.OperationalError:
+                    pass  # already there
+                conn.execute('CREATE INDEX IF NOT EXISTS jobs_by_session ON jobs (session_id)')
+                conn.execute('CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (cache_key, updated)')
+        except sqlite3.Error as e:
+            print(f"Job checkpoints unavailable: {e}")
+    
+    def delete(self, conn, checkpoint_id):
+        for table in ('jobs', 'job_images', 'job_urls'):
+            conn.execute(f'DELETE FROM {table} WHERE checkpoint_id = ?', (checkpoint_id,))
+    
+    def load_refs(self):
+        """Drop expired checkpoints and keep the blobs of the rest alive across restarts"""
+        try:
+            with self.connect() as conn:
+                expired = conn.execute('SELECT checkpoint_id FROM jobs WHERE updated < ?',
+                                       (time.time() - self.ttl,)).fetchall()
+                for (checkpoint_id,) in expired:
+                    self.delete(conn, checkpoint_id)
+                rows = conn.execute('SELECT checkpoint_id, data FROM job_images').fetchall()
+        except sqlite3.Error as e:
+            print(f"Job checkpoint load failed: {e}")
+            return
+        for checkpoint_id, data in rows:
+            blob = json.loads(data).get('blob')
+            if blob:
+                blob_store.acquire(blob, self.owner(checkpoint_id))
+    
+    def create(self, session_id, cache_key, topic, quantity, engines, threshold, exclude_seen=False):
+        checkpoint_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            with self.connect() as conn:
+                conn.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (checkpoint_id, session_id, cache_key, topic, quantity,
+                              json.dumps(list(engines or [])), threshold, now, now, int(exclude_seen)))
+        except sqlite3.Error as e:
+            print(f"Job checkpoint create failed: {e}")
+            return None
+        return checkpoint_id
+    
+    def claim(self, session_id, cache_key=None):
+        """Take over this session's checkpoint, or a dead job's for the same search;
+        returns {'checkpoint_id', 'images': [(image, phash)], 'urls'} or None"""
+        now = time.time()
+        try:
+            with self.connect() as conn:
+                row = conn.execute('SELECT checkpoint_id FROM jobs WHERE session_id = ?', (session_id,)).fetchone()
+                if not row and cache_key:
+                    row = conn.execute('SELECT checkpoint_id FROM jobs WHERE cache_key = ? AND updated < ? '
+                                       'ORDER BY updated DESC LIMIT 1', (cache_key, now - self.stale)).fetchone()
+                if not row:
+                    return None
+                checkpoint_id = row[0]
+                # Conditional update so two workers can't both adopt a dead job
+                claimed = conn.execute('UPDATE jobs SET session_id = ?, updated = ? WHERE checkpoint_id = ? '
+                                       'AND (session_id = ? OR updated < ?)',
+                                       (session_id, now, checkpoint_id, session_id, now - self.stale)).rowcount
+                if not claimed:
+                    return None
+                images = conn.execute('SELECT data, phash FROM job_images WHERE checkpoint_id = ? '
+                                      'ORDER BY position', (checkpoint_id,)).fetchall()
+                urls = conn.execute('SELECT url FROM job_urls WHERE checkpoint_id = ?', (checkpoint_id,)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Job checkpoint claim failed: {e}")
+            return None
+        return {
+            'checkpoint_id': checkpoint_id,
+            'images': [(ImageRecord.from_dict(json.loads(data)), int(phash, 16) if phash else None)
+                       for data, phash in images],
+            'urls': {url for (url,) in urls}
+        }
+    
+    def reserve(self, session_id):
+        """Mark a dead session's job as being resumed, returns its search parameters or None"""
+        now = time.time()
+        try:
+            with self.connect() as conn:
+                reserved = conn.execute('UPDATE jobs SET updated = ? WHERE session_id = ? AND updated < ?',
+                                        (now, session_id, now - self.stale)).rowcount
+                if not reserved:
+                    return None
+                row = conn.execute('SELECT topic, quantity, engines, threshold, exclude_seen FROM jobs '
+                                   'WHERE session_id = ?', (session_id,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return {'topic': row[0], 'quantity': row[1], 'engines': tuple(json.loads(row[2])) or None,
+                'threshold': row[3], 'exclude_seen': bool(row[4])}
+    
+    def save(self, checkpoint_id, images, urls):
+        """Append accepted images [(position, image, phash)] and fetched URLs, refreshing the heartbeat"""
+        for _, image, _ in images:
+            if image.get('blob'):
+                blob_store.acquire(image['blob'], self.owner(checkpoint_id))
+        try:
+            with self.connect() as conn:
+                conn.executemany('INSERT OR REPLACE INTO job_images VALUES (?, ?, ?, ?, ?)',
+                                 [(checkpoint_id, image.get('hash') or image.get('blob'), position,
+                                   json.dumps(image, default=ImageRecord.to_dict),
+                                   format(phash, 'x') if phash is not None else None)
+                                  for position, image, phash in images])
+                conn.executemany('INSERT OR IGNORE INTO job_urls VALUES (?, ?)',
+                                 [(checkpoint_id, url) for url in urls])
+                conn.execute('UPDATE jobs SET updated = ? WHERE checkpoint_id = ?', (time.time(), checkpoint_id))
+        except sqlite3.Error as e:
+            print(f"Job checkpoint write failed: {e}")
+    
+    def finish(self, checkpoint_id):
+        """Forget a completed job and release its blob references"""
+        try:
+            with self.connect() as conn:
+                self.delete(conn, checkpoint_id)
+        except sqlite3.Error as e:
+            print(f"Job checkpoint delete failed: {e}")
+        blob_store.release(self.owner(checkpoint_id))
+    
+    def clear(self):
+        try:
+            with self.connect() as conn:
+                checkpoint_ids = [r[0] for r in conn.execute('SELECT checkpoint_id FROM jobs')]
+                for table in ('jobs', 'job_images', 'job_urls'):
+                    conn.execute(f'DELETE FROM {table}')
+        except sqlite3.Error:
+            return 0
+        for checkpoint_id in checkpoint_ids:
+            blob_store.release(self.owner(checkpoint_id))
+        return len(checkpoint_ids)
+
+job_checkpoints = JobCheckpoints()
+
+# Persistent cross-topic duplicate index (dataset mode); point IMAGE_HASH_INDEX at the
+# same file as Scrapper.py to share it with the CLI
+HASH_INDEX_DB = os.environ.get('IMAGE_HASH_INDEX', os.path.join('/tmp', 'hash_index.db'))  # Use /tmp for Vercel
+dataset_indexes = {}  # near-duplicate threshold -> HashIndex
+dataset_indexes_lock = Lock()
+
+def dataset_index(near_duplicate_threshold):
+    """Shared persistent index for a threshold, opened on first use"""
+    with dataset_indexes_lock:
+        if near_duplicate_threshold not in dataset_indexes:
+            dataset_indexes[near_duplicate_threshold] = HashIndex(HASH_INDEX_DB, near_duplicate_threshold)
+        return dataset_indexes[near_duplicate_threshold]
+
+# Extra downloads allowed past the target to absorb duplicates without a refill round
+QUOTA_OVERSHOOT = 0.1
+ENGINE_RESULT_OVERSHOOT = 20  # URLs each engine looks for past the target, to cover rejects
+
+class QuotaImageDownloader(ImageDownloader):
+    """icrawler downloader that claims every download from the scraper's shared quota
+    and runs under the engine's adaptive concurrency limit"""
+    
+    def __init__(self, thread_num, signal, session, storage, scraper=None, concurrency=None):
+        super().__init__(thread_num, signal, session, storage)
+        self.scraper = scraper
+        self.concurrency = concurrency
+    
+    def download(self, task, default_ext, timeout=5, max_retry=3, overwrite=False, **kwargs):
+        if self.scraper is None:
+            return super().download(task, default_ext, timeout, max_retry, overwrite, **kwargs)
+        task['success'] = False
+        task['filename'] = None
+        if task['file_url'] in self.scraper.seen_urls:
+            return  # Fetched before this job was resumed
+        if self.concurrency and not self.concurrency.acquire(self.scraper.should_stop):
+            self.signal.set(reach_max_num=True)
+            return
+        latency = None
+        try:
+            if not self.scraper.claim_slot():
+                # Target met (or job cancelled): stop feeder, parser and downloaders
+                self.signal.set(reach_max_num=True)
+                return
+            try:
+                # The storage backend processes the image inside this call
+                started = time.time()
+                super().download(task, default_ext, timeout, max_retry, overwrite, **kwargs)
+                if not self.scraper.should_stop():
+                    latency = time.time() - started
+                    # Successful fetches are classified by the storage backend; icrawler only logs failures
+                    self.scraper.observe_download(self.storage.engine_name,
+                                                  None if task['success'] else 'error', seconds=latency)
+                    if task['success']:
+                        self.scraper.mark_url(task['file_url'])
+            finally:
+                self.scraper.release_slot()
+        finally:
+            if self.concurrency:
+                self.concurrency.release(latency, task['success'])
+
+class ScraperStorage(BaseStorage):
+    """icrawler storage backend that hands each image to the scraper the moment it is downloaded"""
+    
+    def __init__(self, scraper, engine_name, query):
+        self.scraper = scraper
+        self.engine_name = engine_name
+        self.query = query
+    
+    def write(self, id, data):
+        self.scraper.add_image_bytes(self.engine_name, self.query, data)
+    
+    def exists(self, id):
+        return False
+    
+    def max_file_idx(self):
+        return 0
+
 class ProductionImageScraper:
     """Production-ready instance-based image scraper optimized for Vercel deployment"""
     
-    def __init__(self, session_id=None):
+    def __init__(self, session_id=None, near_duplicate_threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+                 exclude_seen=False):
         self.session_id = session_id
+        self.owner = session_id or str(uuid.uuid4())  # blob store reference holder
         self.all_images = []
         self.seen_hashes = set()
+        self.near_duplicate_threshold = near_duplicate_threshold  # None disables perceptual dedup
+        self.perceptual_index = HammingIndex(near_duplicate_threshold or 0)
+        self.exclude_seen = exclude_seen
+        # Dataset mode also rejects anything collected before, by any crawl or the CLI
+        self.dataset_index = dataset_index(near_duplicate_threshold) if exclude_seen else None
         self.seen_urls = set()
         self.images_lock = Lock()
+        self.quota_changed = Condition(self.images_lock)
         self.is_cancelled = False
         self.download_count = 0
+        self.inflight_downloads = 0  # slots claimed from the shared quota but not yet accepted
+        self.dataset_reserved = 0  # accepted images waiting on their dataset index write
+        self.crawlers = []
+        self.total_target = 0
+        self.accepting = True  # False once the crawl has stopped extending for attached sessions
+        self.session_targets = {session_id: None} if session_id else {}  # attached sessions -> quantity
+        self.metrics = EngineMetrics()  # this crawl's share of engine_metrics
+        self.checkpoint_id = None
+        self.checkpoint_lock = Lock()
+        self.checkpoint_images = []  # (position, image, phash) accepted since the last flush
+        self.checkpoint_urls = []    # URLs fetched since the last flush
+        self.checkpoint_flushed = 0.0
+        self.progress_published = 0.0
+        self.progress_pending = False  # an image was added since the last published update
         
     def update_progress(self, status, message, **kwargs):
         """Thread-safe progress update with real-time count"""
-        if not self.session_id:
+        if not self.session_targets:
             return
             
         with progress_lock:
-            if self.session_id not in progress_data:
-                progress_data[self.session_id] = {}
-            
-            progress_data[self.session_id].update({
-                'status': status,
-                'message': message,
-                'images_found': len(self.all_images),
-                'timestamp': time.time(),
-                **kwargs
-            })
+            # Every session attached to this crawl sees it against its own quantity
+            for session_id, target in list(self.session_targets.items()):
+                fields = {
+                    'status': status,
+                    'message': message,
+                    'images_found': len(self.all_images),
+                    'timestamp': time.time(),
+                    **kwargs
+                }
+                if target:
+                    fields['images_found'] = min(len(self.all_images), target)
+                    fields['total_target'] = target
+                publish_progress(session_id, fields)
+    
+    def attach(self, session_id, quantity):
+        """Share this crawl with another session, extending the target if it needs more;
+        returns False if the crawl has already stopped extending and quantity is past its target"""
+        with self.images_lock:
+            if not self.accepting and quantity > self.total_target:
+                return False
+            self.session_targets[session_id] = quantity
+            self.total_target = max(self.total_target, quantity)
+            return True
+    
+    def target_reached(self):
+        return len(self.all_images) >= self.total_target
+    
+    def should_stop(self):
+        return self.is_cancelled or self.target_reached()
+    
+    def claim_slot(self):
+        """Claim one download from the shared quota, waiting while in-flight downloads may still fill it"""
+        with self.quota_changed:
+            while not self.should_stop():
+                limit = self.total_target + int(self.total_target * QUOTA_OVERSHOOT)
+                if len(self.all_images) + self.inflight_downloads < limit:
+                    self.inflight_downloads += 1
+                    return True
+                self.quota_changed.wait(0.5)
+            return False
+    
+    def count_download(self):
+        """Count a fetched image (for wasted_downloads), from any download thread"""
+        with self.images_lock:
+            self.download_count += 1
+    
+    def release_slot(self, count=1):
+        with self.quota_changed:
+            self.inflight_downloads = max(self.inflight_downloads - count, 0)
+            self.quota_changed.notify_all()
+    
+    def start_checkpoint(self, cache_key, query, quantity, engines, threshold):
+        """Resume from this session's (or a dead identical job's) checkpoint, or start a new one"""
+        state = job_checkpoints.claim(self.owner, cache_key)
+        if state is None:
+            self.checkpoint_id = job_checkpoints.create(self.owner, cache_key, query, quantity, engines, threshold,
+                                                        self.exclude_seen)
+            return 0
+        
+        self.checkpoint_id = state['checkpoint_id']
+        with self.images_lock:
+            for image, phash in state['images']:
+                # Skip anything the blob store lost while the job was down
+                if image.get('blob') and not os.path.exists(blob_store.path_for(image['blob'])):
+                    continue
+                self.all_images.append(image)
+                if image.get('hash'):
+                    self.seen_hashes.add(image['hash'])
+                if phash is not None and self.near_duplicate_threshold is not None:
+                    self.perceptual_index.add(phash)
+                if image.get('blob'):
+                    blob_store.acquire(image['blob'], self.owner)
+            self.seen_urls.update(state['urls'])
+        self.update_progress('starting', f'Resuming with {len(self.all_images)} images already fetched',
+                             total_target=quantity, resumed=len(self.all_images))
+        return len(self.all_images)
+    
+    def mark_url(self, url):
+        """Remember a fetched URL so neither this job nor a resumed one downloads it again"""
+        self.seen_urls.add(url)
+        if self.checkpoint_id:
+            with self.checkpoint_lock:
+                self.checkpoint_urls.append(url)
+    
+    def flush_checkpoint(self):
+        """Write pending images and URLs (an empty flush still refreshes the heartbeat)"""
+        if not self.checkpoint_id:
+            return
+        self.checkpoint_flushed = time.time()
+        with self.checkpoint_lock:
+            images, self.checkpoint_images = self.checkpoint_images, []
+            urls, self.checkpoint_urls = self.checkpoint_urls, []
+        job_checkpoints.save(self.checkpoint_id, images, urls)
+    
+    def finish_checkpoint(self):
+        if self.checkpoint_id:
+            job_checkpoints.finish(self.checkpoint_id)
+            self.checkpoint_id = None
+    
+    def observe_search(self, engine_name, seconds, ok=True):
+        self.metrics.observe_search(engine_name, seconds, ok)
+        engine_metrics.observe_search(engine_name, seconds, ok)
+    
+    def observe_download(self, engine_name, outcome=None, size=0, seconds=None):
+        self.metrics.observe_download(engine_name, outcome, size, seconds)
+        engine_metrics.observe_download(engine_name, outcome, size, seconds)
+    
+    def run_engine(self, engine, query, images_per_engine, total_target):
+        """Run one engine plugin, recording how long it was active"""
+        started = time.time()
+        try:
+            engine.run(self, query, images_per_engine, total_target)
+        finally:
+            elapsed = time.time() - started
+            self.metrics.observe_run(engine.name, elapsed)
+            engine_metrics.observe_run(engine.name, elapsed)
+    
+    def stop_crawlers(self):
+        """Signal running icrawler crawlers to stop feeding, parsing and downloading"""
+        for crawler in list(self.crawlers):
+            crawler.signal.set(reach_max_num=True)
             
     def safe_add_image(self, image_data):
         """Thread-safe image addition with immediate progress update"""
+        # Decode outside the lock so workers don't serialize on image decoding
+        phash = None
+        if self.near_duplicate_threshold is not None and image_data.get('local_path'):
+            phash = dhash(image_data['local_path'])
+            
+        img_hash = image_data.get('hash')
+        reserve = self.dataset_index is not None and bool(img_hash)
         with self.images_lock:
-            if self.is_cancelled:
+            # Downloads still in flight when the target is met are dropped, not added past it
+            if self.is_cancelled or len(self.all_images) + self.dataset_reserved >= self.total_target:
                 return False
                 
             # Check for duplicates
-            img_hash = image_data.get('hash')
             if img_hash and img_hash in self.seen_hashes:
                 return False
                 
-            # Add image
-            self.all_images.append(image_data)
-            if img_hash:
-                self.seen_hashes.add(img_hash)
-                
-            # Update progress immediately
-            self.update_progress(
-                'downloading',
-                f'Found {len(self.all_images)} images',
-                current_engine=image_data.get('engine', ''),
-                total_target=progress_data.get(self.session_id, {}).get('total_target', 0)
-            )
+            # Check for resized / re-encoded copies of an image we already have
+            if phash is not None and self.perceptual_index.find(phash) is not None:
+                return False
             
-            return True
+            if reserve:
+                # Hold a slot for it so the index only ever gains images this job delivers
+                self.seen_hashes.add(img_hash)
+                self.dataset_reserved += 1
+            else:
+                publish = self.append_image(image_data, img_hash, phash)
+        
+        if reserve:
+            # The index write goes to SQLite, so it runs outside images_lock
+            is_new = self.dataset_index.add_if_new(img_hash, phash, image_data.get('local_path'))
+            with self.images_lock:
+                self.dataset_reserved -= 1
+                if not is_new:
+                    self.seen_hashes.discard(img_hash)
+                    self.quota_changed.notify_all()
+                    return False
+                publish = self.append_image(image_data, img_hash, phash)
+        
+        # Outside images_lock so workers don't queue behind progress_lock
+        if publish:
+            self.publish_image_progress(image_data.get('engine', ''))
+        if self.target_reached():
+            self.stop_crawlers()
+        return True
+    
+    def append_image(self, image_data, img_hash, phash):
+        """Add an accepted image (images_lock held); returns whether to publish progress now"""
+        # Numbered under the lock so concurrent workers never share a filename
+        if isinstance(image_data, ImageRecord):
+            image_data.number = len(self.all_images) + 1
+        self.all_images.append(image_data)
+        if img_hash:
+            self.seen_hashes.add(img_hash)
+        if phash is not None:
+            self.perceptual_index.add(phash)
+        if image_data.get('blob'):
+            blob_store.acquire(image_data['blob'], self.owner)
+        if self.checkpoint_id:
+            with self.checkpoint_lock:
+                self.checkpoint_images.append((len(self.all_images) - 1, image_data, phash))
+        self.quota_changed.notify_all()
+        
+        # Coalesce per-image updates; the join loop publishes any that were held back
+        now = time.time()
+        publish = self.target_reached() or now - self.progress_published >= PROGRESS_UPDATE_INTERVAL
+        if publish:
+            self.progress_published = now
+        self.progress_pending = not publish
+        return publish
+    
+    def publish_image_progress(self, engine_name):
+        self.update_progress('downloading', f'Found {len(self.all_images)} images',
+                             current_engine=engine_name, total_target=self.total_target)
+    
+    def flush_progress(self):
+        """Publish the image count if coalescing held the last update back"""
+        with self.images_lock:
+            if not self.progress_pending:
+                return
+            self.progress_pending = False
+            self.progress_published = time.time()
+            engine_name = self.all_images[-1].get('engine', '') if self.all_images else ''
+        self.publish_image_progress(engine_name)
     
     def cancel(self):
         """Cancel the scraping operation"""
         self.is_cancelled = True
+        self.stop_crawlers()
+        with self.quota_changed:
+            self.quota_changed.notify_all()
 
-    def scrape_engine_threaded(self, engine_name, crawler_class, query, images_per_engine, total_target):
+    def scrape_engine_threaded(self, engine, query, images_per_engine, total_target):
         """Thread-safe engine scraping with real-time updates"""
+        engine_name = engine.name
         try:
             if self.is_cancelled:
                 return
@@ -92,75 +2044,30 @@ class ProductionImageScraper:
             self.update_progress('searching', f'Starting {engine_name.title()} search...', 
                                current_engine=engine_name, total_target=total_target)
             
-            # Create temporary directory
-            temp_dir = tempfile.mkdtemp(prefix=f"prod_{engine_name}_")
+            # Create crawler (downloads are drawn from the shared quota and stored as they arrive);
+            # threads are capped at the engine's ceiling and gated by its adaptive limit
+            crawler = engine.crawler_class(
+                downloader_cls=QuotaImageDownloader,
+                downloader_threads=engine.concurrency.maximum,
+                storage=ScraperStorage(self, engine_name, query),
+                extra_downloader_args={'scraper': self, 'concurrency': engine.concurrency}
+            )
+            self.crawlers.append(crawler)
             
+            # Scrape images
             try:
-                # Create crawler
-                crawler = crawler_class(
-                    downloader_threads=2,  # Reduced for Vercel limits
-                    storage={'root_dir': temp_dir}
-                )
-                
-                # Scrape images
-                crawler.crawl(keyword=query, max_num=images_per_engine)
-                
-                # Process downloaded images
-                if os.path.exists(temp_dir):
-                    files = [f for f in os.listdir(temp_dir) 
-                            if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp'))]
-                    
-                    # Create static directory if needed
-                    static_temp = os.path.join('/tmp', 'temp_images')  # Use /tmp for Vercel
-                    os.makedirs(static_temp, exist_ok=True)
-                    
-                    for i, filename in enumerate(files):
-                        if self.is_cancelled or len(self.all_images) >= total_target:
-                            break
-                            
-                        try:
-                            src_path = os.path.join(temp_dir, filename)
-                            
-                            # Skip small files
-                            if os.path.getsize(src_path) < 3000:
-                                continue
-                                
-                            # Calculate hash
-                            img_hash = self.calculate_image_hash(src_path)
-                            
-                            # Create unique filename
-                            file_ext = os.path.splitext(filename)[1] or '.jpg'
-                            unique_name = f"prod_{engine_name}_{int(time.time())}_{i}{file_ext}"
-                            dest_path = os.path.join(static_temp, unique_name)
-                            
-                            # Copy file
-                            shutil.copy2(src_path, dest_path)
-                            
-                            # Add to results
-                            image_data = {
-                                'url': f"/static/temp_images/{unique_name}",
-                                'filename': f"{safe_folder_name(query)}_{engine_name}_{len(self.all_images)+1}{file_ext}",
-                                'engine': engine_name,
-                                'local_path': dest_path,
-                                'hash': img_hash,
-                                'temp_path': dest_path  # For Vercel cleanup
-                            }
-                            
-                            self.safe_add_image(image_data)
-                            
-                        except Exception as e:
-                            continue
-                            
+                if not self.should_stop():
+                    crawler.crawl(keyword=query, max_num=images_per_engine)
             finally:
-                # Clean up
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir, ignore_errors=True)
+                self.crawlers.remove(crawler)
                     
         except Exception as e:
             print(f"Error with {engine_name}: {e}")
+            self.observe_search(engine_name, 0.0, ok=False)
     
-    def scrape_custom_engine_threaded(self, engine_name, query, images_per_engine, total_target):
+    def scrape_custom_engine_threaded(self, engine, query, images_per_engine, total_target):
         """Thread-safe custom engine scraping"""
+        engine_name = engine.name
         try:
             if self.is_cancelled:
                 return
@@ -168,215 +2075,375 @@ class ProductionImageScraper:
             self.update_progress('searching', f'Starting {engine_name.title()} URL search...', 
                                current_engine=engine_name, total_target=total_target)
             
-            # Get URLs
-            if engine_name == 'yandex':
-                image_urls = self.scrape_yandex_images(query, images_per_engine)
-            elif engine_name == 'duckduckgo':
-                image_urls = self.scrape_duckduckgo_images(query, images_per_engine)
-            else:
-                return
-            
-            if not image_urls:
-                return
+            # Download on the shared pool as each results page arrives, taking the engine's and the
+            # host's slots before a worker so a throttled engine or a busy CDN never ties up pool
+            # threads other sessions could use (and the next page is only fetched once this one's
+            # URLs are queued)
+            pages = engine.pages(self, query, images_per_engine)
+            futures = {}  # Future -> host slot it holds until it runs
+            found = 0
+            # A session attached mid-crawl raises total_target, and this engine keeps paging for it
+            while found < max(images_per_engine, self.total_target + ENGINE_RESULT_OVERSHOOT) \
+                    and not self.should_stop():
+                started = time.time()
+                try:
+                    image_urls = next(pages, None)
+                except Exception:
+                    self.observe_search(engine_name, time.time() - started, ok=False)
+                    if not futures:
+                        raise
+                    break  # keep what earlier pages found
+                if not image_urls:
+                    break
+                self.observe_search(engine_name, time.time() - started)
+                found += len(image_urls)
                 
-            self.update_progress('downloading', f'Found {len(image_urls)} URLs from {engine_name.title()}', 
-                               current_engine=engine_name, total_target=total_target)
-            
-            # Create static directory
-            static_temp = os.path.join('/tmp', 'temp_images')  # Use /tmp for Vercel
-            os.makedirs(static_temp, exist_ok=True)
+                self.update_progress('downloading', f'Found {found} URLs from {engine_name.title()}', 
+                                   current_engine=engine_name, total_target=total_target)
+                
+                for img_url in image_urls:
+                    if img_url in self.seen_urls:
+                        continue
+                    if not engine.concurrency.acquire(self.should_stop):
+                        break
+                    host_slot = download_engine.acquire_host(img_url, self.should_stop)
+                    if host_slot is None:
+                        engine.concurrency.release()
+                        break
+                    futures[download_engine.submit(
+                        self.download_custom_image, engine, query, img_url, total_target, host_slot)] = host_slot
             
-            # Download images
-            for i, img_url in enumerate(image_urls):
-                if self.is_cancelled or len(self.all_images) >= total_target:
+            for future in as_completed(futures):
+                if self.should_stop():
+                    # Drop downloads that have not started yet (and the slots they hold)
+                    for pending, host_slot in futures.items():
+                        if pending.cancel():
+                            host_slot.release()
+                            engine.concurrency.release()
                     break
                     
-                if img_url in self.seen_urls:
-                    continue
-                    
-                try:
-                    # Create filename
-                    file_ext = '.jpg'
-                    if '.' in img_url:
-                        potential_ext = img_url.split('.')[-1].lower().split('?')[0]
-                        if potential_ext in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                            file_ext = f'.{potential_ext}'
-                    
-                    unique_name = f"prod_{engine_name}_{int(time.time())}_{i}{file_ext}"
-                    dest_path = os.path.join(static_temp, unique_name)
-                    
-                    # Download
-                    if self.download_image_from_url(img_url, dest_path):
-                        if os.path.exists(dest_path) and os.path.getsize(dest_path) > 3000:
-                            img_hash = self.calculate_image_hash(dest_path)
-                            
-                            image_data = {
-                                'url': f"/static/temp_images/{unique_name}",
-                                'filename': f"{safe_folder_name(query)}_{engine_name}_{len(self.all_images)+1}{file_ext}",
-                                'engine': engine_name,
-                                'local_path': dest_path,
-                                'hash': img_hash,
-                                'temp_path': dest_path  # For Vercel cleanup
-                            }
-                            
-                            if self.safe_add_image(image_data):
-                                self.seen_urls.add(img_url)
-                                
-                except Exception as e:
-                    continue
-                    
         except Exception as e:
             print(f"Error with custom engine {engine_name}: {e}")
     
+    def add_image_bytes(self, engine_name, query, data):
+        """Validate, hash, deduplicate, store and publish an image downloaded by icrawler"""
+        try:
+            if self.should_stop():
+                return False
+            # The extension comes from the bytes, not the URL
+            file_ext, dimensions = sniff_image(data[:SNIFF_MAX_BYTES])
+            if file_ext is None:
+                self.observe_download(engine_name, 'rejected', len(data))
+                return False
+            if len(data) < MIN_IMAGE_BYTES or too_small(dimensions):
+                self.observe_download(engine_name, 'too_small', len(data))
+                return False
+            self.count_download()
+            
+            # Duplicates never touch the disk
+            img_hash = hashlib.md5(data).hexdigest()
+            if img_hash in self.seen_hashes:
+                self.observe_download(engine_name, 'duplicate', len(data))
+                return False
+            
+            part_path = os.path.join(blob_store.root, 'incoming', f"{uuid.uuid4().hex}.part")
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            with open(part_path, 'wb') as f:
+                f.write(data)
+            blob_name = blob_store.put(part_path, img_hash, file_ext)
+            added = self.add_blob_image(engine_name, query, img_hash, blob_name, file_ext)
+            if added or not self.should_stop():  # late arrivals past the target aren't duplicates
+                self.observe_download(engine_name, 'success' if added else 'duplicate', len(data))
+            return added
+            
+        except Exception as e:
+            print(f"Error storing {engine_name} image: {e}")
+            self.observe_download(engine_name, 'error')
+            return False
+    
+    def add_blob_image(self, engine_name, query, img_hash, blob_name, file_ext):
+        """Add an image already in the blob store to the results"""
+        image_data = ImageRecord(blob_name, engine_name, safe_folder_name(query), 0)  # numbered when added
+        if not self.safe_add_image(image_data):
+            return False
+        # Previews are made off the download path; originals stay untouched for download
+        thumbnails.submit(blob_name)
+        return True
+    
+    def download_custom_image(self, engine, query, img_url, total_target, host_slot):
+        """Download a single custom engine result and add it to the results
+        (runs holding an engine concurrency slot and a host slot, which it releases)"""
+        latency, ok = None, True
+        outcome, size = None, 0
+        try:
+            if not self.claim_slot():
+                host_slot.release()
+                return False
+            started = time.time()
+            try:
+                # Download (validated and hashed while streaming)
+                img_hash, blob_name, size = self.download_image_from_url(img_url, host_slot)
+                latency = time.time() - started
+                if img_hash:
+                    self.count_download()
+                    outcome = 'duplicate'
+                    if blob_name:
+                        file_ext = os.path.splitext(blob_name)[1]
+                        if self.add_blob_image(engine.name, query, img_hash, blob_name, file_ext):
+                            outcome = 'success'
+                            return True
+                            
+            except ImageRejected as e:
+                latency, outcome, size = time.time() - started, e.reason, e.size
+            except Exception as e:
+                latency, ok, outcome = time.time() - started, False, 'error'
+            finally:
+                self.release_slot()
+        finally:
+            # Aborted downloads say nothing about the engine's capacity
+            stopped = self.should_stop() and outcome != 'success'
+            engine.concurrency.release(None if stopped else latency, ok)
+            if not stopped and outcome:
+                self.observe_download(engine.name, outcome, size, latency)
+                if outcome != 'error':
+                    self.mark_url(img_url)
+        return False
+    
     def calculate_image_hash(self, image_path):
-        """Calculate image hash for duplicate detection"""
+        """Calculate image hash for duplicate detection in fixed-size chunks"""
         try:
+            hasher = hashlib.md5()
             with open(image_path, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            return hasher.hexdigest()
         except:
             return None
     
-    def download_image_from_url(self, url, save_path):
-        """Download image with production-ready error handling"""
+    def download_image_from_url(self, url, host_slot=None):
+        """Download image into the blob store, returns (md5, blob name, bytes) with a None blob name
+        for duplicates, or (None, None, 0) if aborted; raises ImageRejected or network errors
+        (host_slot is a per-host slot the caller already holds, released once the body is in)"""
+        part_path = os.path.join(blob_store.root, 'incoming', f"{uuid.uuid4().hex}.part")
+        if host_slot is None:
+            host_slot = download_engine.host_slot(url)
+            host_slot.acquire()
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
+            # Hold the host slot for the whole body so one host can't take every connection
+            try:
+                os.makedirs(os.path.dirname(part_path), exist_ok=True)
+                img_hash, size, file_ext = self._fetch_image(url, part_path)
+            finally:
+                host_slot.release()
             
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            if not img_hash:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                return None, None, 0
             
-            response = requests.get(url, headers=headers, timeout=10, stream=True, verify=False)
+            # Duplicates never reach the store
+            if img_hash in self.seen_hashes:
+                os.remove(part_path)
+                return img_hash, None, size
+            
+            return img_hash, blob_store.put(part_path, img_hash, file_ext), size
+            
+        except Exception:
+            if os.path.exists(part_path):
+                try:
+                    os.remove(part_path)
+                except:
+                    pass
+            raise
+    
+    def _fetch_image(self, url, save_path):
+        """Stream an image over the shared keep-alive session, validating headers and magic bytes
+        before anything is written; returns (md5, bytes, extension) or (None, 0, None) if the job stopped"""
+        with download_engine.session.get(url, timeout=10, stream=True, verify=False) as response:
             response.raise_for_status()
             
-            # Check content type
-            content_type = response.headers.get('content-type', '').lower()
-            if not any(t in content_type for t in ['image/', 'jpeg', 'png', 'gif', 'webp']):
-                return False
+            # Header checks cost no body bytes
+            content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+            if content_type and not content_type.startswith('image/') and content_type not in SNIFF_CONTENT_TYPES:
+                raise ImageRejected('rejected')
+            declared_size = response.headers.get('content-length', '')
+            if declared_size.isdigit():
+                if int(declared_size) > MAX_IMAGE_BYTES:
+                    raise ImageRejected('rejected')
+                if int(declared_size) < MIN_IMAGE_BYTES:
+                    raise ImageRejected('too_small')
             
-            # Download with size limit (5MB for Vercel)
             total_size = 0
-            max_size = 5 * 1024 * 1024
-            
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        total_size += len(chunk)
-                        if total_size > max_size:
-                            os.remove(save_path)
-                            return False
+            hasher = hashlib.md5()
+            head = b''       # buffered until the format (and ideally dimensions) are confirmed
+            file_ext = None
+            f = None
+            try:
+                for chunk in response.iter_content(chunk_size=HASH_CHUNK_SIZE):
+                    # Abandon in-flight downloads as soon as the target is met
+                    if self.should_stop():
+                        return None, 0, None
+                    if not chunk:
+                        continue
+                    total_size += len(chunk)
+                    if total_size > MAX_IMAGE_BYTES:
+                        raise ImageRejected('rejected', total_size)
+                    hasher.update(chunk)
+                    if f is not None:
                         f.write(chunk)
+                        continue
+                    
+                    head += chunk
+                    file_ext, dimensions = sniff_image(head)
+                    if file_ext is None:
+                        if len(head) >= SNIFF_MIN_BYTES:
+                            raise ImageRejected('rejected', total_size)
+                        continue
+                    if too_small(dimensions):
+                        raise ImageRejected('too_small', total_size)
+                    if dimensions is None and len(head) < SNIFF_MAX_BYTES:
+                        continue
+                    f = open(save_path, 'wb')
+                    f.write(head)
+                
+                if f is None:
+                    # Whole body fit in the sniff buffer
+                    file_ext, dimensions = sniff_image(head)
+                    if file_ext is None:
+                        raise ImageRejected('rejected', total_size)
+                    if too_small(dimensions) or total_size < MIN_IMAGE_BYTES:
+                        raise ImageRejected('too_small', total_size)
+                    f = open(save_path, 'wb')
+                    f.write(head)
+                elif total_size < MIN_IMAGE_BYTES:
+                    raise ImageRejected('too_small', total_size)
+            finally:
+                if f is not None:
+                    f.close()
             
-            return os.path.exists(save_path) and os.path.getsize(save_path) > 1000
-            
-        except Exception as e:
-            if os.path.exists(save_path):
-                try:
-                    os.remove(save_path)
-                except:
-                    pass
-            return False
+            return hasher.hexdigest(), total_size, file_ext
+    
+    def fetch_result_page(self, url):
+        """GET a search results page over the shared keep-alive session"""
+        response = download_engine.session.get(url, timeout=SEARCH_TIMEOUT)
+        response.raise_for_status()
+        return response
+    
+    def yandex_result_pages(self, query):
+        """Yield the new thumbnail URLs of each Yandex results page in turn"""
+        seen = set()
+        for page in range(SEARCH_MAX_PAGES):
+            search_url = (f"https://yandex.com/images/search?text={urllib.parse.quote_plus(query)}"
+                          + (f"&p={page}" if page else ""))
+            urls = search_page_cache.get_or_fetch(
+                'yandex', query, page, lambda: parse_yandex_page(self.fetch_result_page(search_url).content))
+            urls = [url for url in urls if url not in seen]
+            if not urls:
+                return
+            seen.update(urls)
+            yield urls
+    
+    def duckduckgo_result_pages(self, query):
+        """Yield the image URLs of the DuckDuckGo results page, then of each i.js JSON page"""
+        search_url = f"https://duckduckgo.com/?q={urllib.parse.quote_plus(query)}&t=h_&iax=images&ia=images"
+        urls, vqd = search_page_cache.get_or_fetch(
+            'duckduckgo', query, 0, lambda: parse_duckduckgo_page(self.fetch_result_page(search_url).content))
+        seen = set(urls)
+        if urls:
+            yield urls
+        if not vqd:
+            return
+        
+        def fetch_json(page):
+            json_url = (f"https://duckduckgo.com/i.js?l=us-en&o=json&q={urllib.parse.quote_plus(query)}"
+                        f"&vqd={vqd}&f=,,,,,&p=1&s={(page - 1) * DUCKDUCKGO_PAGE_SIZE}")
+            data = self.fetch_result_page(json_url).json()
+            return [r['image'] for r in data.get('results', []) if r.get('image', '').startswith('http')], \
+                bool(data.get('next'))
+        
+        for page in range(1, SEARCH_MAX_PAGES):
+            urls, more = search_page_cache.get_or_fetch('duckduckgo', query, page, lambda: fetch_json(page))
+            urls = [url for url in urls if url not in seen]
+            if urls:
+                seen.update(urls)
+                yield urls
+            if not more:
+                return
     
     def scrape_yandex_images(self, query, max_images):
-        """Production Yandex scraper"""
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-            search_url = f"https://yandex.com/images/search?text={urllib.parse.quote_plus(query)}"
-            
-            response = requests.get(search_url, headers=headers, timeout=8)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            images = []
-            img_elements = soup.find_all('img', class_='serp-item__thumb')
-            
-            for img in img_elements[:max_images]:
-                if 'src' in img.attrs:
-                    img_url = img['src']
-                    if img_url.startswith('//'):
-                        img_url = 'https:' + img_url
-                    elif img_url.startswith('/'):
-                        img_url = 'https://yandex.com' + img_url
-                    
-                    if img_url.startswith('http'):
-                        images.append(img_url)
-            
-            return images
-        except:
-            return []
+        """Production Yandex scraper (request errors propagate to the engine metrics)"""
+        images = []
+        for urls in self.yandex_result_pages(query):
+            images.extend(urls)
+            if len(images) >= max_images:
+                break
+        return images[:max_images]
     
     def scrape_duckduckgo_images(self, query, max_images):
-        """Production DuckDuckGo scraper"""
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-            search_url = f"https://duckduckgo.com/?q={urllib.parse.quote_plus(query)}&t=h_&iax=images&ia=images"
-            
-            response = requests.get(search_url, headers=headers, timeout=8)
-            if response.status_code != 200:
-                return []
-                
-            soup = BeautifulSoup(response.content, 'html.parser')
-            images = []
-            img_elements = soup.find_all('img')
-            
-            for img in img_elements[:max_images]:
-                if 'src' in img.attrs:
-                    img_url = img['src']
-                    if img_url.startswith('//'):
-                        img_url = 'https:' + img_url
-                    elif img_url.startswith('/'):
-                        img_url = 'https://duckduckgo.com' + img_url
-                    
-                    if img_url.startswith('http') and 'logo' not in img_url.lower():
-                        images.append(img_url)
-            
-            return images
-        except:
-            return []
+        """Production DuckDuckGo scraper (request errors propagate to the engine metrics)"""
+        images = []
+        for urls in self.duckduckgo_result_pages(query):
+            images.extend(urls)
+            if len(images) >= max_images:
+                break
+        return images[:max_images]
+    
+    def run_engines(self, engines, query, images_per_engine, total_target):
+        """Run engine plugins side by side until they finish, checkpointing progress as it comes in"""
+        threads = []
+        for engine in engines:
+            thread = Thread(target=self.run_engine, args=(engine, query, images_per_engine, total_target))
+            thread.start()
+            threads.append(thread)
+        
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(PROGRESS_UPDATE_INTERVAL)
+                self.flush_progress()
+                if time.time() - self.checkpoint_flushed >= JOB_CHECKPOINT_INTERVAL:
+                    self.flush_checkpoint()
     
-    def scrape_multi_engine(self, query, total_images_needed):
+    def scrape_multi_engine(self, query, total_images_needed, engines=None):
         """Production multi-engine scraping with real-time progress"""
+        with self.images_lock:
+            self.total_target = max(self.total_target, total_images_needed)
+            if self.session_id:
+                self.session_targets[self.session_id] = total_images_needed
         self.update_progress('starting', 'Initializing production search...', total_target=total_images_needed)
         
-        # Engine configuration
-        engines = {
-            'bing': BingImageCrawler,
-            'google': GoogleImageCrawler
-        }
-        custom_engines = ['yandex', 'duckduckgo']
+        # Engine plugins for this request
+        engines = [ENGINE_REGISTRY[name] for name in resolve_engines(engines)]
         
-        total_engines = len(engines) + len(custom_engines)
-        images_per_engine = (total_images_needed // total_engines) + 20
+        total_engines = len(engines)
         
         self.update_progress('searching', f'Searching {total_engines} engines...', total_target=total_images_needed)
         
-        threads = []
-        
-        # Start engine threads
-        for engine_name, crawler_class in engines.items():
-            thread = Thread(target=self.scrape_engine_threaded, 
-                          args=(engine_name, crawler_class, query, images_per_engine, total_images_needed))
-            thread.start()
-            threads.append(thread)
-        
-        # Start custom engine threads
-        for engine_name in custom_engines:
-            thread = Thread(target=self.scrape_custom_engine_threaded,
-                          args=(engine_name, query, images_per_engine, total_images_needed))
-            thread.start()
-            threads.append(thread)
-        
-        # Wait for completion
-        for thread in threads:
-            thread.join()
+        # Any engine may cover the whole target; the shared quota stops them once it is met.
+        # A session that attached with a larger quantity after the engines sized their search
+        # gets another round at its size (fetched URLs and known hashes are skipped)
+        searched_target = 0
+        while True:
+            with self.images_lock:
+                if self.is_cancelled or self.target_reached() or self.total_target <= searched_target:
+                    self.accepting = False
+                    break
+                searched_target = self.total_target
+            self.run_engines(engines, query, searched_target + ENGINE_RESULT_OVERSHOOT, total_images_needed)
+        self.flush_progress()
+        self.flush_checkpoint()
         
         # Final results
         final_images = self.all_images[:total_images_needed]
+        wasted_downloads = max(self.download_count - len(final_images), 0)
         
         if len(final_images) >= total_images_needed:
             self.update_progress('completed', f'Successfully found {len(final_images)} images!', 
-                               total_target=total_images_needed)
+                               total_target=total_images_needed, wasted_downloads=wasted_downloads,
+                               engine_metrics=self.metrics.summary())
         else:
             self.update_progress('completed', f'Found {len(final_images)} images', 
-                               total_target=total_images_needed)
+                               total_target=total_images_needed, wasted_downloads=wasted_downloads,
+                               engine_metrics=self.metrics.summary())
         
         return final_images
 
@@ -386,15 +2453,70 @@ def safe_folder_name(name: str) -> str:
     name = name.strip().replace(" ", "_")
     return name
 
-def scrape_images_multi_engine(query, total_images_needed, session_id=None):
-    """Production wrapper for the new class-based scraper"""
-    scraper = ProductionImageScraper(session_id)
-    return scraper.scrape_multi_engine(query, total_images_needed)
+class SearchCoalescer:
+    """Single-flight search: concurrent jobs for the same topic share one running crawl"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.inflight = {}  # (normalized topic, threshold, engines, exclude_seen) -> {'scraper', 'done'}
+        self.crawls = 0
+        self.coalesced = 0
+    
+    def run(self, query, total_images_needed, session_id=None,
+            near_duplicate_threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD, engines=None, exclude_seen=False):
+        engines = resolve_engines(engines)
+        key = (QueryCache.normalize_topic(query), near_duplicate_threshold, engines, exclude_seen)
+        while True:
+            with self.lock:
+                flight = self.inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = {'scraper': ProductionImageScraper(session_id, near_duplicate_threshold, exclude_seen),
+                              'done': threading.Event()}
+                    self.inflight[key] = flight
+                    self.crawls += 1
+                    break
+                if flight['scraper'].attach(session_id, total_images_needed):
+                    self.coalesced += 1
+                    break
+            # Finishing crawl too small for us: wait for it to go, then lead (or join) the next one
+            flight['done'].wait()
+        
+        scraper = flight['scraper']
+        if leader:
+            try:
+                cache_key = QueryCache.make_key(query, total_images_needed, engines, near_duplicate_threshold,
+                                                exclude_seen)
+                scraper.start_checkpoint(cache_key, query, total_images_needed, engines, near_duplicate_threshold)
+                scraper.scrape_multi_engine(query, total_images_needed, engines)
+                # Only a job that ran to the end drops its checkpoint; failures stay resumable
+                scraper.finish_checkpoint()
+            finally:
+                with self.lock:
+                    del self.inflight[key]
+                flight['done'].set()
+            return scraper.all_images[:total_images_needed]
+        
+        flight['done'].wait()
+        final_images = scraper.all_images[:total_images_needed]
+        # The leader's session owns the blobs; take our own references
+        for img in final_images:
+            if img.get('blob'):
+                blob_store.acquire(img['blob'], session_id or scraper.owner)
+        if session_id:
+            update_progress(session_id, 'completed', f'Found {len(final_images)} images',
+                            len(final_images), total_images_needed,
+                            engine_metrics=scraper.metrics.summary())
+        return final_images
+
+search_coalescer = SearchCoalescer()
 
-def scrape_images_multi_engine(query, total_images_needed, session_id=None):
-    """Production wrapper for the new class-based scraper"""
-    scraper = ProductionImageScraper(session_id)
-    return scraper.scrape_multi_engine(query, total_images_needed)
+def scrape_images_multi_engine(query, total_images_needed, session_id=None,
+                               near_duplicate_threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD, engines=None,
+                               exclude_seen=False):
+    """Production wrapper for the new class-based scraper, coalescing identical searches"""
+    return search_coalescer.run(query, total_images_needed, session_id, near_duplicate_threshold, engines,
+                                exclude_seen)
 
 @app.route('/')
 def index():
@@ -425,33 +2547,79 @@ def about():
     """About page for SEO"""
     return render_template('index.html')  # For now, redirect to main page
 
+def progress_view(data):
+    """(progress without the image list, whether the session is done)"""
+    if not data:
+        return None, False
+    # The image list is fetched from /results, never streamed
+    snapshot = {k: v for k, v in data.items() if k != 'images'}
+    finished = data.get('status') == 'error' or (data.get('status') == 'completed' and 'images' in data)
+    return snapshot, finished
+
 @app.route('/progress/<session_id>')
 def progress_stream(session_id):
-    """Server-Sent Events endpoint for real-time progress updates"""
+    """Server-Sent Events endpoint pushing progress deltas as they are published"""
+    # A session no worker knows may belong to a job lost in a restart
+    if progress_snapshot(session_id) is None:
+        resume_job(session_id, client_id_for(request))
+    
     def generate():
-        while True:
-            with progress_lock:
-                if session_id in progress_data:
-                    data = progress_data[session_id].copy()
-                    yield f"data: {json.dumps(data)}\n\n"
-                    
-                    # If completed or error, stop streaming
-                    if data.get('status') in ['completed', 'error']:
-                        break
-                else:
+        sent = {}
+        version = -1
+        with progress_lock:
+            if session_id not in progress_events:
+                progress_events[session_id] = [Condition(progress_lock), 0]
+            subscription = progress_events[session_id]
+            subscription[1] += 1
+        
+        try:
+            while True:
+                with progress_lock:
+                    local = session_id in progress_data or not progress_backend.shared
+                    if local:
+                        changed = subscription[0].wait_for(
+                            lambda: progress_versions.get(session_id, 0) != version, timeout=PROGRESS_HEARTBEAT)
+                        current = progress_versions.get(session_id, 0)
+                        data = progress_data.get(session_id)
+                        snapshot, finished = progress_view(data)
+                if not local:
+                    # Another worker runs this job
+                    changed, current, data = wait_for_shared_progress(session_id, version, PROGRESS_HEARTBEAT)
+                    snapshot, finished = progress_view(data)
+                
+                if not changed:
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                if snapshot is None:
+                    if version > 0:
+                        break  # Session expired
+                    version = current
                     yield f"data: {json.dumps({'status': 'waiting', 'message': 'Initializing...'})}\n\n"
-            
-            time.sleep(0.5)  # Update every 500ms
+                    continue
+                
+                version = current
+                delta = {k: v for k, v in snapshot.items() if k not in sent or sent[k] != v}
+                sent.update(delta)
+                if delta:
+                    yield f"data: {json.dumps(delta)}\n\n"
+                
+                # If completed or error, stop streaming
+                if finished:
+                    break
+        finally:
+            with progress_lock:
+                subscription[1] -= 1
+                if subscription[1] == 0 and progress_events.get(session_id) is subscription:
+                    del progress_events[session_id]
     
-    return Response(generate(), mimetype='text/plain')
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 def update_progress(session_id, status, message, images_found=0, total_target=0, current_engine='', **kwargs):
     """Thread-safe progress update compatible with both old and new system"""
     with progress_lock:
-        if session_id not in progress_data:
-            progress_data[session_id] = {}
-        
-        progress_data[session_id].update({
+        publish_progress(session_id, {
             'status': status,
             'message': message,
             'images_found': images_found,
@@ -461,16 +2629,321 @@ def update_progress(session_id, status, message, images_found=0, total_target=0,
             **kwargs
         })
 
+# Deferred cleanup and temp storage expiry
+PROGRESS_RETENTION = 5 * 60  # progress data outlives its job this long
+PART_FILE_MAX_AGE = 10 * 60  # downloads interrupted by a crash leave .part files behind
+LEGACY_TEMP_DIRS = (os.path.join('/tmp', 'temp_images'), os.path.join('static', 'temp_images'))
+
+def expire_files(directory, max_age):
+    """Delete files in directory not modified for max_age seconds, returns the count removed"""
+    removed = 0
+    now = time.time()
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return 0
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    forget_image_file(entry.name)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+def drop_progress(session_id):
+    """Forget a finished session's progress data"""
+    with progress_lock:
+        forget_progress_results(session_id)
+        progress_backend.drop(session_id)
+        if session_id in progress_data:
+            del progress_data[session_id]
+            print(f"Cleaned up progress data for session: {session_id}")
+        # Wake any remaining streams so they see the session is gone
+        progress_versions.pop(session_id, None)
+        if session_id in progress_events:
+            progress_events[session_id][0].notify_all()
+
+class StorageReaper:
+    """One thread for all deferred cleanup: a heap of per-session timers, plus a periodic sweep
+    that expires temp files by age and holds the image store to its disk budget"""
+    
+    def __init__(self, interval=BLOB_GC_INTERVAL, budget=TEMP_STORAGE_BUDGET):
+        self.interval = interval
+        self.budget = budget
+        self.condition = Condition()
+        self.timers = []  # heap of (due time, sequence, callback)
+        self.sequence = 0
+        self.finished = OrderedDict()  # session id -> time its job finished, oldest first
+        self.next_sweep = time.time() + interval
+        self.thread = None
+        self.sweeps = 0
+        self.files_expired = 0
+        self.bytes_evicted = 0
+        self.sessions_evicted = 0
+    
+    def start(self):
+        """Start the reaper thread once"""
+        if self.thread is not None:
+            return
+        with self.condition:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+    
+    def schedule(self, delay, callback):
+        with self.condition:
+            heapq.heappush(self.timers, (time.time() + delay, self.sequence, callback))
+            self.sequence += 1
+            self.condition.notify()
+        self.start()
+    
+    def session_finished(self, session_id):
+        """Expire a finished session's progress data, then (later) its download links and images"""
+        with self.condition:
+            self.finished.pop(session_id, None)
+            self.finished[session_id] = time.time()
+        self.schedule(PROGRESS_RETENTION, lambda: drop_progress(session_id))
+        # Download links stay valid for longer than the progress data
+        self.schedule(SESSION_FILE_RETENTION, lambda: self.release_session(session_id))
+    
+    def release_session(self, session_id):
+        """Make a finished session's images collectable, returns False if that already happened"""
+        with self.condition:
+            if self.finished.pop(session_id, None) is None:
+                return False
+        session_index.forget(session_id)
+        # Images only cached elsewhere (or nowhere) become collectable
+        blob_store.release(session_id)
+        return True
+    
+    def run(self):
+        while True:
+            with self.condition:
+                now = time.time()
+                due = []
+                while self.timers and self.timers[0][0] <= now:
+                    due.append(heapq.heappop(self.timers)[2])
+                if not due and now < self.next_sweep:
+                    wake = min(self.next_sweep, self.timers[0][0]) if self.timers else self.next_sweep
+                    self.condition.wait(wake - now)
+                    continue
+            for callback in due:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Deferred cleanup error: {e}")
+            if time.time() >= self.next_sweep:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Storage reaper error: {e}")
+                self.next_sweep = time.time() + self.interval
+    
+    def sweep(self):
+        """Expire by age, then evict least recently used images until under budget"""
+        blob_store.collect()
+        query_cache.expire()
+        progress_backend.expire(SESSION_FILE_RETENTION)
+        expired = expire_files(os.path.join(blob_store.root, 'incoming'), PART_FILE_MAX_AGE)
+        for temp_dir in LEGACY_TEMP_DIRS:
+            expired += expire_files(temp_dir, SESSION_FILE_RETENTION)
+        self.enforce_budget()
+        with self.condition:
+            self.sweeps += 1
+            self.files_expired += expired
+    
+    def enforce_budget(self):
+        """Free space LRU-first: idle images, then cached searches, then the oldest finished sessions"""
+        freed = blob_store.evict_lru(self.budget)
+        while blob_store.total_bytes > self.budget and query_cache.evict_oldest():
+            freed += blob_store.evict_lru(self.budget)
+        evicted = 0
+        while blob_store.total_bytes > self.budget:
+            with self.condition:
+                if not self.finished:
+                    break
+                session_id = next(iter(self.finished))
+            if self.release_session(session_id):
+                evicted += 1
+            freed += blob_store.evict_lru(self.budget)
+        with self.condition:
+            self.bytes_evicted += freed
+            self.sessions_evicted += evicted
+    
+    def stats(self):
+        with self.condition:
+            return {
+                'budget_bytes': self.budget,
+                'timers': len(self.timers),
+                'finished_sessions': len(self.finished),
+                'sweeps': self.sweeps,
+                'files_expired': self.files_expired,
+                'bytes_evicted': self.bytes_evicted,
+                'sessions_evicted': self.sessions_evicted
+            }
+
+storage_reaper = StorageReaper()
+
 def cleanup_progress(session_id):
-    """Clean up progress data after completion"""
-    def cleanup():
-        time.sleep(300)  # Keep data for 5 minutes after completion
+    """Clean up progress data after completion (on the reaper's timers, not a thread per session)"""
+    storage_reaper.session_finished(session_id)
+
+# Scrape job admission limits
+JOB_WORKERS = 4
+JOB_QUEUE_LIMIT = 32
+JOB_CLIENT_QUEUE_LIMIT = 4
+
+class JobScheduler:
+    """Fixed worker pool fed by a bounded queue served round-robin across clients"""
+    
+    def __init__(self, workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT, client_limit=JOB_CLIENT_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.client_limit = client_limit
+        self.cond = Condition()
+        self.queues = OrderedDict()  # client_id -> deque of (session_id, fn, future); front client goes next
+        self.queued = 0
+        self.running = 0
+        self.avg_duration = 30.0     # moving average of job run time, for retry hints
+        self.threads = []
+    
+    def submit(self, client_id, session_id, fn):
+        """Queue fn for a client, returns a Future or None when the queue is saturated"""
+        with self.cond:
+            if self.queued >= self.queue_limit or len(self.queues.get(client_id, ())) >= self.client_limit:
+                return None
+            
+            future = Future()
+            self.queues.setdefault(client_id, deque()).append((session_id, fn, future))
+            self.queued += 1
+            
+            while len(self.threads) < self.workers:
+                thread = Thread(target=self.worker, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            
+            self.publish_positions()
+            self.cond.notify()
+            return future
+    
+    def queue_order(self):
+        """Session ids in the order they will run (caller holds cond)"""
+        order = []
+        pending = [list(queue) for queue in self.queues.values()]
+        depth = 0
+        while any(depth < len(jobs) for jobs in pending):
+            order.extend(jobs[depth][0] for jobs in pending if depth < len(jobs))
+            depth += 1
+        return order
+    
+    def publish_positions(self):
+        """Report each waiting session's position through its progress data (caller holds cond)"""
         with progress_lock:
-            if session_id in progress_data:
-                del progress_data[session_id]
-                print(f"Cleaned up progress data for session: {session_id}")
+            for position, session_id in enumerate(self.queue_order(), 1):
+                publish_progress(session_id, {
+                    'status': 'queued',
+                    'message': f'Waiting in queue (position {position})',
+                    'queue_position': position,
+                    'timestamp': time.time()
+                })
+    
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.queued:
+                    self.cond.wait()
+                
+                # Take the front client's oldest job and move that client to the back
+                client_id, queue = next(iter(self.queues.items()))
+                session_id, fn, future = queue.popleft()
+                del self.queues[client_id]
+                if queue:
+                    self.queues[client_id] = queue
+                self.queued -= 1
+                self.running += 1
+                
+                with progress_lock:
+                    publish_progress(session_id, {'queue_position': 0})
+                self.publish_positions()
+            
+            start = time.time()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.cond:
+                    self.running -= 1
+                    self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.time() - start)
     
-    Thread(target=cleanup, daemon=True).start()
+    def retry_after(self):
+        """Seconds until a slot is likely to free up"""
+        with self.cond:
+            return max(1, int(self.avg_duration * (self.queued + 1) / self.workers))
+
+job_scheduler = JobScheduler()
+
+def client_id_for(req):
+    """Identify the caller for fair queueing: the address our own proxy saw (ProxyFix resolves
+    remote_addr from its hop, so a forged X-Forwarded-For can't mint new clients)"""
+    return req.remote_addr or 'unknown'
+
+def background_scrape(session_id, topic, quantity, similarity_threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+                      engines=None, exclude_seen=False):
+    """Scrape job for an AJAX session: run (or resume) the crawl and publish the results"""
+    try:
+        update_progress(session_id, 'starting', 'Initializing search...', 0, quantity)
+        scraped_urls = scrape_images_multi_engine(topic, quantity, session_id, similarity_threshold, engines,
+                                                  exclude_seen)
+        # A short result would be served as the full answer for this quantity, so it isn't cached
+        if not exclude_seen and len(scraped_urls) >= quantity:
+            query_cache.put(QueryCache.make_key(topic, quantity, engines, similarity_threshold), scraped_urls, topic)
+        
+        # Store results in progress data
+        with progress_lock:
+            if session_id in progress_data:
+                publish_progress(session_id, {
+                    'images': scraped_urls,
+                    'topic': topic,
+                    'safe_topic': safe_folder_name(topic),
+                    'requested': quantity
+                })
+        session_index.record(session_id, topic, scraped_urls)
+                
+    except Exception as e:
+        print(f"Background scraping error: {e}")
+        update_progress(session_id, 'error', f'Error occurred: {str(e)}', 0, quantity)
+    finally:
+        cleanup_progress(session_id)
+
+def resume_job(session_id, client_id):
+    """Requeue a checkpointed job whose worker died, returns True if it was resumed"""
+    params = job_checkpoints.reserve(session_id)
+    if not params:
+        return False
+    update_progress(session_id, 'queued', 'Resuming interrupted search...', 0, params['quantity'])
+    job = job_scheduler.submit(client_id, session_id, lambda: background_scrape(
+        session_id, params['topic'], params['quantity'], params['threshold'], params['engines'],
+        params['exclude_seen']))
+    if job is None:
+        # Busy: the reservation lapses and a later poll tries again
+        with progress_lock:
+            discard_progress(session_id)
+        return False
+    return True
+
+@app.route('/resume/<session_id>', methods=['POST'])
+def resume(session_id):
+    """Resume an interrupted search from its checkpoint"""
+    if progress_snapshot(session_id) is not None:
+        return jsonify({'success': True, 'session_id': session_id, 'message': 'Search is already running.'})
+    if not resume_job(session_id, client_id_for(request)):
+        return jsonify({'success': False, 'error': 'No interrupted search to resume', 'session_id': session_id})
+    return jsonify({'success': True, 'session_id': session_id, 'message': 'Search resumed.'})
 
 @app.route('/scrape', methods=['POST'])
 def scrape():
@@ -485,10 +2958,16 @@ def scrape():
                 return jsonify({'success': False, 'error': 'Invalid JSON data'})
             topic = data.get('topic', '').strip()
             quantity = data.get('quantity', 20)
+            similarity_threshold = data.get('similarity_threshold', DEFAULT_NEAR_DUPLICATE_THRESHOLD)
+            engines = data.get('engines')
+            exclude_seen = data.get('exclude_seen', False)
         else:
             # Handle form data
             topic = request.form.get('topic', '').strip()
             quantity = request.form.get('quantity', 20)
+            similarity_threshold = request.form.get('similarity_threshold', DEFAULT_NEAR_DUPLICATE_THRESHOLD)
+            engines = request.form.getlist('engines')
+            exclude_seen = request.form.get('exclude_seen', '')
         
         # Input validation
         if not topic:
@@ -510,6 +2989,41 @@ def scrape():
             else:
                 return render_template('error.html', error=error_msg)
         
+        # Validate near-duplicate threshold (empty/null disables perceptual dedup)
+        try:
+            if similarity_threshold in (None, ''):
+                similarity_threshold = None
+            else:
+                similarity_threshold = int(similarity_threshold)
+                if similarity_threshold < 0 or similarity_threshold > 32:
+                    raise ValueError("Threshold must be between 0 and 32")
+        except (ValueError, TypeError) as e:
+            error_msg = 'Similarity threshold must be a number between 0 and 32'
+            if request.is_json:
+                return jsonify({'success': False, 'error': error_msg, 'session_id': session_id})
+            else:
+                return render_template('error.html', error=error_msg)
+        
+        # Validate engine selection (a list or comma-separated names, empty means the defaults)
+        try:
+            if isinstance(engines, str):
+                engines = [engines]
+            if engines is not None and not isinstance(engines, list):
+                raise ValueError("Engines must be a list of names")
+            names = [name.strip().lower() for item in engines or [] for name in str(item).split(',') if name.strip()]
+            engines = resolve_engines(names)
+        except ValueError as e:
+            error_msg = f"{e}. Available engines: {', '.join(ENGINE_REGISTRY)}"
+            if request.is_json:
+                return jsonify({'success': False, 'error': error_msg, 'session_id': session_id})
+            else:
+                return render_template('error.html', error=error_msg)
+        
+        # Dataset mode: only return images never collected before, by any search
+        if isinstance(exclude_seen, str):
+            exclude_seen = exclude_seen.strip().lower() in ('1', 'true', 'on', 'yes')
+        exclude_seen = bool(exclude_seen)
+        
         # Sanitize topic to prevent issues
         topic = re.sub(r'[<>:"/\\|?*]', '', topic)
         if len(topic) < 2:
@@ -519,27 +3033,53 @@ def scrape():
             else:
                 return render_template('error.html', error=error_msg)
         
+        # Fast path: a repeat search is served straight from the query cache
+        # (never in dataset mode, where everything cached has been seen already)
+        cache_key = QueryCache.make_key(topic, quantity, engines, similarity_threshold)
+        cached_images = None if exclude_seen else query_cache.get(cache_key)
+        
         # For JSON requests (AJAX), start background task and return session ID
         if request.is_json:
-            def background_scrape():
-                try:
-                    update_progress(session_id, 'starting', 'Initializing search...', 0, quantity)
-                    scraped_urls = scrape_images_multi_engine(topic, quantity, session_id)
-                    
-                    # Store results in progress data
-                    with progress_lock:
-                        if session_id in progress_data:
-                            progress_data[session_id]['images'] = scraped_urls
-                            progress_data[session_id]['topic'] = topic
-                            progress_data[session_id]['safe_topic'] = safe_folder_name(topic)
-                            progress_data[session_id]['requested'] = quantity
-                            
-                except Exception as e:
-                    print(f"Background scraping error: {e}")
-                    update_progress(session_id, 'error', f'Error occurred: {str(e)}', 0, quantity)
+            if cached_images is not None:
+                update_progress(session_id, 'completed', f'Found {len(cached_images)} images (cached)',
+                                len(cached_images), quantity, cached=True)
+                with progress_lock:
+                    publish_progress(session_id, {
+                        'images': cached_images,
+                        'topic': topic,
+                        'safe_topic': safe_folder_name(topic),
+                        'requested': quantity
+                    })
+                for img in cached_images:
+                    if img.get('blob'):
+                        blob_store.acquire(img['blob'], session_id)
+                session_index.record(session_id, topic, cached_images)
+                cleanup_progress(session_id)
+                
+                return jsonify({
+                    'success': True,
+                    'session_id': session_id,
+                    'cached': True,
+                    'message': 'Results served from cache.'
+                })
             
-            # Start background task
-            Thread(target=background_scrape, daemon=True).start()
+            # Queue the job; refuse with a retry hint when saturated
+            if job_scheduler.submit(client_id_for(request), session_id,
+                                    lambda: background_scrape(session_id, topic, quantity,
+                                                              similarity_threshold, engines,
+                                                              exclude_seen)) is None:
+                with progress_lock:
+                    discard_progress(session_id)
+                retry_after = job_scheduler.retry_after()
+                response = jsonify({
+                    'success': False,
+                    'error': 'Server is busy, please try again shortly.',
+                    'retry_after': retry_after,
+                    'session_id': session_id
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
             
             return jsonify({
                 'success': True,
@@ -550,15 +3090,31 @@ def scrape():
         else:
             # For form submissions, do synchronous processing (for backward compatibility)
             try:
-                print(f"Scraping {quantity} images for '{topic}'...")
-                
-                # Use the multi-engine scraper with progress tracking
-                scraped_urls = scrape_images_multi_engine(topic, quantity, session_id)
+                if cached_images is not None:
+                    scraped_urls = cached_images
+                    for img in cached_images:
+                        if img.get('blob'):
+                            blob_store.acquire(img['blob'], session_id)
+                else:
+                    print(f"Scraping {quantity} images for '{topic}'...")
+                    
+                    # Use the multi-engine scraper with progress tracking, through the same job queue
+                    job = job_scheduler.submit(
+                        client_id_for(request), session_id,
+                        lambda: scrape_images_multi_engine(topic, quantity, session_id, similarity_threshold, engines,
+                                                           exclude_seen))
+                    if job is None:
+                        return render_template('error.html', error='Server is busy, please try again in a few moments.'), 429
+                    scraped_urls = job.result()
+                    if not exclude_seen and len(scraped_urls) >= quantity:
+                        query_cache.put(cache_key, scraped_urls, topic)
             
                 if not scraped_urls:
                     error_msg = 'No images could be scraped. Please try a different search term.'
                     return render_template('error.html', error=error_msg)
                 
+                session_index.record(session_id, topic, scraped_urls)
+                
                 # Render results page for form submission
                 return render_template('results.html', 
                                      images=scraped_urls, 
@@ -567,12 +3123,18 @@ def scrape():
                                      safe_topic=safe_folder_name(topic),
                                      total=len(scraped_urls),
                                      total_found=len(scraped_urls),
-                                     requested=quantity)
+                                     requested=quantity,
+                                     session_id=session_id)
                 
             except Exception as e:
                 print(f"Scraping error: {e}")
                 error_msg = f'Error occurred: {str(e)}'
                 return render_template('error.html', error=error_msg)
+            finally:
+                # Session data is only needed for the follow-up download routes. The session
+                # counts as finished only once its job has ended, so the reaper never releases
+                # the images of a running crawl
+                cleanup_progress(session_id)
     
     except Exception as e:
         # Handle unexpected errors
@@ -586,43 +3148,252 @@ def scrape():
 @app.route('/results/<session_id>')
 def get_results(session_id):
     """Get the final results for a completed scraping session"""
-    with progress_lock:
-        if session_id not in progress_data:
-            return render_template('error.html', error='Session not found or expired')
-        
-        data = progress_data[session_id]
-        
-        if data.get('status') != 'completed':
-            return render_template('error.html', error='Scraping not yet completed')
-        
-        if 'images' not in data:
-            return render_template('error.html', error='No results found for this session')
-        
-        return render_template('results.html',
-                             images=data['images'],
-                             image_urls=data['images'],
-                             topic=data['topic'],
-                             safe_topic=data['safe_topic'],
-                             total=len(data['images']),
-                             total_found=len(data['images']),
-                             requested=data['requested'])
+    # Any worker can answer, whichever one ran the job
+    data = progress_snapshot(session_id)
+    if data is None:
+        return render_template('error.html', error='Session not found or expired')
+    
+    if data.get('status') != 'completed':
+        return render_template('error.html', error='Scraping not yet completed')
+    
+    if 'images' not in data:
+        return render_template('error.html', error='No results found for this session')
+    
+    return render_template('results.html',
+                         images=data['images'],
+                         image_urls=data['images'],
+                         topic=data['topic'],
+                         safe_topic=data['safe_topic'],
+                         total=len(data['images']),
+                         total_found=len(data['images']),
+                         requested=data['requested'],
+                         session_id=session_id)
 
-@app.route('/static/temp_images/<filename>')
-def serve_temp_image(filename):
-    """Serve temporary images from /tmp directory for Vercel"""
-    try:
-        # Check both locations
+@app.route('/cache/stats')
+def cache_stats():
+    """Query cache hit rate and bytes saved"""
+    stats = query_cache.stats()
+    stats['blob_store'] = blob_store.stats()
+    stats['search_pages'] = search_page_cache.stats()
+    stats['hot_images'] = hot_images.stats()
+    stats['storage'] = storage_reaper.stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics():
+    """Per-engine latency, outcome and throughput metrics in Prometheus text format"""
+    return Response(engine_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/engines')
+def engines_info():
+    """Registered engines, whether they are on by default, and their current concurrency"""
+    return jsonify({
+        name: {'enabled': engine.enabled, 'concurrency': engine.concurrency.stats()}
+        for name, engine in ENGINE_REGISTRY.items()
+    })
+
+# Served images are immutable once written (content-addressed names)
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+LEGACY_IMAGE_MAX_AGE = 5 * 60  # legacy temp names can be reused, so only briefly cacheable
+RESOLVED_PATH_CACHE_SIZE = 4096
+HOT_IMAGE_CACHE_BYTES = int(os.environ.get('HOT_IMAGE_CACHE_BYTES', 64 * 1024 * 1024))  # 0 disables
+HOT_IMAGE_MAX_OBJECT = 2 * 1024 * 1024  # larger images always stream from disk
+HOT_IMAGE_HISTORY_SIZE = 8192           # names seen once, admitted to memory on their next miss
+
+resolved_paths = OrderedDict()  # image name -> resolved path, least recently used first
+resolved_paths_lock = Lock()
+
+class HotImageCache:
+    """Byte-budgeted LRU of immutable image bytes in front of the disk store
+    
+    An image is admitted on its second miss, so one-off requests stream from disk
+    (send_file, which the WSGI server can turn into sendfile) without evicting hot ones.
+    """
+    
+    def __init__(self, max_bytes=HOT_IMAGE_CACHE_BYTES, max_object=HOT_IMAGE_MAX_OBJECT,
+                 history_size=HOT_IMAGE_HISTORY_SIZE):
+        self.max_bytes = max_bytes
+        self.max_object = max_object
+        self.history_size = history_size
+        self.lock = Lock()
+        self.entries = OrderedDict()  # image name -> bytes, least recently used first
+        self.history = OrderedDict()  # image name -> None, names missed once
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+    
+    def get(self, filename):
+        """Cached bytes, or None (counted as a miss)"""
+        with self.lock:
+            data = self.entries.get(filename)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(filename)
+            self.hits += 1
+            self.bytes_served += len(data)
+            return data
+    
+    def should_admit(self, filename, size):
+        """Record a miss, returns True if the image is worth reading into memory now"""
+        if size > self.max_object or size > self.max_bytes:
+            return False
+        with self.lock:
+            if filename in self.history:
+                del self.history[filename]
+                return True
+            self.history[filename] = None
+            if len(self.history) > self.history_size:
+                self.history.popitem(last=False)
+            return False
+    
+    def put(self, filename, data):
+        with self.lock:
+            if filename in self.entries:
+                return
+            self.entries[filename] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+    
+    def discard(self, filename):
+        with self.lock:
+            data = self.entries.pop(filename, None)
+            if data is not None:
+                self.bytes -= len(data)
+            self.history.pop(filename, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.history.clear()
+            self.bytes = 0
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes_served': self.bytes_served
+            }
+
+hot_images = HotImageCache()
+
+def find_image_file(filename):
+    """Resolve an image name to a path: cached, O(1) for blobs, legacy temp dirs otherwise"""
+    with resolved_paths_lock:
+        file_path = resolved_paths.get(filename)
+        if file_path:
+            resolved_paths.move_to_end(filename)
+            return file_path
+    
+    file_path = None
+    blob_name = ThumbnailPipeline.blob_for(filename)
+    if blob_store.is_blob_name(filename):
+        file_path = blob_store.path_for(filename)
+    elif blob_name and blob_store.is_blob_name(blob_name):
+        # Serve the original until the thumbnail is ready (not cached, so later requests pick it up)
+        file_path = thumbnails.ensure(blob_name)
+        if not file_path:
+            return blob_store.path_for(blob_name)
+    else:
         temp_locations = [
             os.path.join('/tmp', 'temp_images'),
             os.path.join('static', 'temp_images')
         ]
-        
         for temp_path in temp_locations:
-            file_path = os.path.join(temp_path, filename)
-            if os.path.exists(file_path):
-                return send_file(file_path)
+            candidate = os.path.join(temp_path, filename)
+            if os.path.exists(candidate):
+                file_path = candidate
+                break
+    
+    if file_path:
+        with resolved_paths_lock:
+            resolved_paths[filename] = file_path
+            if len(resolved_paths) > RESOLVED_PATH_CACHE_SIZE:
+                resolved_paths.popitem(last=False)
+    return file_path
+
+def forget_image_file(filename):
+    """Drop a cached path (and bytes) whose file has gone (collected or cleared)"""
+    with resolved_paths_lock:
+        resolved_paths.pop(filename, None)
+    hot_images.discard(filename)
+
+def immutable_image_response(response, etag):
+    """Mark a content-addressed image response as cacheable forever"""
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def image_bytes_response(filename, data, etag):
+    """Serve in-memory image bytes, answering Range requests like send_file does"""
+    response = Response(data, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    immutable_image_response(response, etag)
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+def image_etag(filename):
+    """Strong ETag from the content hash in a blob or thumbnail name, None for legacy names"""
+    blob_name = ThumbnailPipeline.blob_for(filename)
+    if blob_store.is_blob_name(filename):
+        return filename.split('.', 1)[0]
+    if blob_name and blob_store.is_blob_name(blob_name):
+        return f"{blob_name.split('.', 1)[0]}-thumb"
+    return None
+
+@app.route('/static/temp_images/<filename>')
+def serve_temp_image(filename):
+    """Serve stored images with strong ETags, immutable caching, 304s and Range support"""
+    try:
+        etag = image_etag(filename)
+        
+        # Revalidation of a content-addressed image never touches the disk
+        if etag and request.if_none_match.contains(etag):
+            return immutable_image_response(Response(status=304), etag)
+        
+        # Hot content-addressed images come straight from memory (legacy names can be rewritten)
+        data = hot_images.get(filename) if etag and hot_images.max_bytes else None
+        if data is not None:
+            return image_bytes_response(filename, data, etag)
         
-        return "Image not found", 404
+        file_path = find_image_file(filename)
+        if not file_path:
+            return "Image not found", 404
+        if ThumbnailPipeline.blob_for(filename) and not file_path.endswith(THUMBNAIL_SUFFIX):
+            # Thumbnail not made yet: the original stands in, so it is neither cached under the
+            # thumbnail's name nor given its immutable ETag
+            etag = None
+        
+        try:
+            if etag and hot_images.max_bytes and hot_images.should_admit(filename, os.path.getsize(file_path)):
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                hot_images.put(filename, data)
+                return image_bytes_response(filename, data, etag)
+            
+            # conditional=True answers If-None-Match/If-Modified-Since and Range requests
+            response = send_file(file_path, conditional=True, etag=etag or True,
+                                 max_age=IMAGE_CACHE_MAX_AGE if etag else LEGACY_IMAGE_MAX_AGE)
+        except FileNotFoundError:
+            forget_image_file(filename)
+            return "Image not found", 404
+        
+        if etag:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
     except Exception as e:
         return f"Error serving image: {str(e)}", 500
 
@@ -630,125 +3401,94 @@ def serve_temp_image(filename):
 def download_image(topic, index):
     """Download individual image"""
     try:
-        # Find the image in temp directory (check both locations for compatibility)
-        temp_locations = [
-            os.path.join('/tmp', 'temp_images'),
-            os.path.join('static', 'temp_images')
-        ]
-        
-        files = []
-        for temp_dir in temp_locations:
-            if os.path.exists(temp_dir):
-                dir_files = os.listdir(temp_dir)
-                for f in dir_files:
-                    # Check multiple patterns: prod_ prefix or topic-based names
-                    if (f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')) and 
-                        (f.startswith('prod_') or 
-                         safe_folder_name(topic).lower() in f.lower() or
-                         f.startswith(safe_folder_name(topic)))):
-                        files.append(f)
-        
-        if index >= len(files):
+        # Resolve through the session index (?session= scopes it to one user's results)
+        entry = session_index.get(request.args.get('session'), topic)
+        if not entry or index >= len(entry['files']):
             return "Image not found", 404
         
-        # Find the actual file path
-        file_path = None
-        for temp_dir in temp_locations:
-            potential_path = os.path.join(temp_dir, files[index])
-            if os.path.exists(potential_path):
-                file_path = potential_path
-                break
+        name, filename = entry['files'][index]
+        file_path = find_image_file(name)
         
-        if not file_path:
+        if not file_path or not os.path.exists(file_path):
             return "Image not found", 404
         
-        # Get file extension for proper filename
-        _, ext = os.path.splitext(files[index])
-        filename = f"{safe_folder_name(topic)}_{index+1}{ext}"
-        
-        return send_file(file_path, as_attachment=True, download_name=filename)
+        # Conditional so interrupted downloads can resume with Range
+        return send_file(file_path, as_attachment=True, download_name=filename,
+                         conditional=True, etag=image_etag(name) or True)
         
     except Exception as e:
         print(f"Download error: {e}")
         return f"Error downloading image: {str(e)}", 500
 
+class ZipStreamBuffer(io.RawIOBase):
+    """Write-only sink that hands ZipFile output to a generator chunk by chunk"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+# Formats that are already compressed are stored as-is
+ZIP_STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+ZIP_CHUNK_SIZE = 64 * 1024
+
+def stream_zip(entries):
+    """Yield a ZIP archive of (file_path, archive_name) pairs with constant memory"""
+    sink = ZipStreamBuffer()
+    with zipfile.ZipFile(sink, 'w') as zip_file:
+        for file_path, archive_name in entries:
+            info = zipfile.ZipInfo.from_file(file_path, archive_name)
+            if archive_name.lower().endswith(ZIP_STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            
+            with open(file_path, 'rb') as src, zip_file.open(info, 'w') as dest:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b''):
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    # Central directory is written on close
+    yield sink.drain()
+
 @app.route('/download_all/<topic>')
 def download_all_zip(topic):
-    """Download all images as ZIP"""
+    """Download all images as a streamed ZIP"""
     try:
-        # Check both temp locations for compatibility
-        temp_locations = [
-            os.path.join('/tmp', 'temp_images'),
-            os.path.join('static', 'temp_images')
-        ]
+        entry = session_index.get(request.args.get('session'), topic)
+        if not entry or not entry['files']:
+            return "No images found for this topic. Please run a search first.", 404
         
-        files = []
-        for temp_dir in temp_locations:
-            if os.path.exists(temp_dir):
-                # Look for files with different naming patterns
-                dir_files = os.listdir(temp_dir)
-                for f in dir_files:
-                    # Check multiple patterns: prod_ prefix or topic-based names
-                    if (f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')) and 
-                        (f.startswith('prod_') or 
-                         safe_folder_name(topic).lower() in f.lower() or
-                         f.startswith(safe_folder_name(topic)))):
-                        files.append(f)
-        
-        print(f"DEBUG: Looking for topic '{topic}', safe_name '{safe_folder_name(topic)}'")
-        print(f"DEBUG: Found {len(files)} files: {files[:5]}...")  # Show first 5 files
-        
-        if not files:
-            # Get session results if available
-            session_files = []
-            with progress_lock:
-                for session_id, data in progress_data.items():
-                    if data.get('topic') == topic and data.get('status') == 'completed':
-                        images = data.get('images', [])
-                        for img in images:
-                            local_path = img.get('local_path') or img.get('temp_path')
-                            if local_path and os.path.exists(local_path):
-                                session_files.append(os.path.basename(local_path))
-            
-            if session_files:
-                files = session_files
-                print(f"DEBUG: Found {len(session_files)} files from session data")
-            else:
-                return "No images found for this topic. Please run a search first.", 404
-        
-        # Create ZIP in memory
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            added_count = 0
-            for i, filename in enumerate(files):
-                # Find the actual file path
-                file_path = None
-                for temp_dir in temp_locations:
-                    potential_path = os.path.join(temp_dir, filename)
-                    if os.path.exists(potential_path):
-                        file_path = potential_path
-                        break
-                
-                if file_path:
-                    # Use a clean filename in the ZIP
-                    _, ext = os.path.splitext(filename)
-                    clean_name = f"{safe_folder_name(topic)}_{added_count+1}{ext}"
-                    zip_file.write(file_path, clean_name)
-                    added_count += 1
-        
-        if added_count == 0:
-            return f"No accessible image files found for '{topic}'. Files may have expired.", 404
+        # Resolve files up front so missing files give a 404 instead of a truncated archive
+        entries = []
+        for name, filename in entry['files']:
+            file_path = find_image_file(name)
+            if file_path and os.path.exists(file_path):
+                # Use a clean filename in the ZIP
+                _, ext = os.path.splitext(filename)
+                entries.append((file_path, f"{safe_folder_name(topic)}_{len(entries)+1}{ext}"))
         
-        zip_buffer.seek(0)
+        if not entries:
+            return f"No accessible image files found for '{topic}'. Files may have expired.", 404
         
-        zip_filename = f"{safe_folder_name(topic)}_images_{added_count}_files.zip"
+        zip_filename = f"{safe_folder_name(topic)}_images_{len(entries)}_files.zip"
         
-        return send_file(
-            io.BytesIO(zip_buffer.read()),
+        return Response(
+            stream_zip(entries),
             mimetype='application/zip',
-            as_attachment=True,
-            download_name=zip_filename
+            headers={'Content-Disposition': f'attachment; filename="{zip_filename}"'}
         )
         
     except Exception as e:
@@ -759,47 +3499,36 @@ def download_all_zip(topic):
 def debug_files(topic):
     """Debug route to check what files exist for a topic"""
     try:
-        temp_locations = [
-            os.path.join('/tmp', 'temp_images'),
-            os.path.join('static', 'temp_images')
-        ]
-        
         debug_info = {
             'topic': topic,
             'safe_topic': safe_folder_name(topic),
-            'locations_checked': temp_locations,
-            'files_found': {}
+            'indexed_sessions': []
         }
         
-        for temp_dir in temp_locations:
-            if os.path.exists(temp_dir):
-                all_files = os.listdir(temp_dir)
-                matching_files = []
-                for f in all_files:
-                    if (f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')) and 
-                        (f.startswith('prod_') or 
-                         safe_folder_name(topic).lower() in f.lower() or
-                         f.startswith(safe_folder_name(topic)))):
-                        matching_files.append(f)
-                
-                debug_info['files_found'][temp_dir] = {
-                    'total_files': len(all_files),
-                    'matching_files': matching_files,
-                    'first_5_all_files': all_files[:5]
-                }
-            else:
-                debug_info['files_found'][temp_dir] = {'error': 'Directory does not exist'}
+        for session_id in session_index.sessions_for_topic(topic):
+            entry = session_index.get(session_id)
+            if not entry:
+                continue
+            files = [name for name, _ in entry['files']]
+            debug_info['indexed_sessions'].append({
+                'session_id': session_id,
+                'files': files,
+                'missing_files': [name for name in files
+                                  if not (find_image_file(name) and os.path.exists(find_image_file(name)))]
+            })
         
         # Check session data
         session_info = []
+        sessions = dict(progress_backend.sessions())
         with progress_lock:
-            for session_id, data in progress_data.items():
+            sessions.update(progress_data)
+            for session_id, data in sessions.items():
                 if data.get('topic') == topic:
                     session_info.append({
                         'session_id': session_id,
                         'status': data.get('status'),
                         'images_count': len(data.get('images', [])),
-                        'sample_image': data.get('images', [{}])[0] if data.get('images') else None
+                        'sample_image': dict(data['images'][0]) if data.get('images') else None
                     })
         
         debug_info['session_data'] = session_info
@@ -834,6 +3563,17 @@ def clear_cache(topic):
                         except Exception as e:
                             print(f"Error deleting {file_path}: {e}")
         
+        # Release the topic's shared blobs; anything no other topic references is deleted now
+        with progress_lock:
+            topic_sessions = set(sid for sid, data in progress_data.items()
+                                 if safe_folder_name(data.get('topic', '')).lower() == clean_topic.lower())
+        topic_sessions.update(session_index.sessions_for_topic(topic))
+        for sid in topic_sessions:
+            blob_store.release(sid)
+            session_index.forget(sid)
+        query_cache.clear_topic(topic)
+        files_deleted += blob_store.collect(grace=0)
+        
         # Clear from downloads folder
         downloads_dir = os.path.join('downloads', clean_topic)
         if os.path.exists(downloads_dir):
@@ -891,6 +3631,15 @@ def clear_all_cache():
                     except Exception as e:
                         print(f"Error deleting {file_path}: {e}")
         
+        # Cached searches now point at deleted files
+        query_cache.clear()
+        session_index.clear()
+        job_checkpoints.clear()
+        with resolved_paths_lock:
+            resolved_paths.clear()
+        hot_images.clear()
+        files_deleted += blob_store.clear()
+        
         # Clear downloads folder
         downloads_dir = 'downloads'
         if os.path.exists(downloads_dir):
@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+DEFAULT_NEAR_DUPLICATE_THRESHOLD = 6  # max differing bits (of 64) to treat two images as the same photo
+DEFAULT_HASH_INDEX = os.environ.get("IMAGE_HASH_INDEX", os.path.join("downloads", ".hash_index.db"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+SCAN_COMMIT_EVERY = 500
+
+
+def dhash(path, hash_size=8):
+    """Perceptual difference hash of an image as a 64-bit int (None if it can't be decoded)."""
+    try:
+        with Image.open(path) as img:
+            # draft() lets JPEG decode straight at a reduced scale
+            img.draft("L", (hash_size * 4, hash_size * 4))
+            small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = list(small.getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+
+class HammingIndex:
+    """Multi-index hash table for sub-linear lookup of hashes within a Hamming threshold.
+
+    The hash is split into threshold + 1 bands; by pigeonhole any hash within
+    threshold bits of a query matches it exactly on at least one band, so only
+    the entries sharing a band bucket need a full distance check.
+    """
+
+    def __init__(self, threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD, bits=64):
+        self.threshold = threshold
+        band_count = min(threshold + 1, bits)
+        base, extra = divmod(bits, band_count)
+        self.bands = []
+        shift = 0
+        for i in range(band_count):
+            width = base + (1 if i < extra else 0)
+            self.bands.append((shift, (1 << width) - 1))
+            shift += width
+        self.tables = [{} for _ in self.bands]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value):
+        self.size += 1
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            table.setdefault((value >> shift) & mask, []).append(value)
+
+    def find(self, value):
+        """Return a stored hash within threshold bits of value, or None."""
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            for candidate in table.get((value >> shift) & mask, ()):
+                if hamming(value, candidate) <= self.threshold:
+                    return candidate
+        return None
+
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class HashIndex:
+    """Persistent duplicate index over every stored image, shared across runs and processes.
+
+    Exact (MD5) lookups go straight to SQLite. Perceptual hashes are mirrored in
+    a HammingIndex that is topped up with rows added since the last lookup, by
+    this or any other process, so nothing is ever rescanned or rehashed.
+    """
+
+    def __init__(self, path=DEFAULT_HASH_INDEX, near_duplicate_threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD):
+        self.path = path
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.perceptual_index = HammingIndex(near_duplicate_threshold or 0)
+        self.loaded_rowid = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS images (md5 TEXT PRIMARY KEY, phash INTEGER, path TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS images_by_phash ON images (phash)")
+            # size/mtime per file so a rescan only hashes what changed
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, md5 TEXT, size INTEGER, mtime REAL)")
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def _refresh(self):
+        rows = self.conn.execute("SELECT rowid, phash FROM images WHERE rowid > ? ORDER BY rowid",
+                                 (self.loaded_rowid,)).fetchall()
+        for rowid, phash in rows:
+            if phash is not None:
+                self.perceptual_index.add(_to_unsigned(phash))
+            self.loaded_rowid = rowid
+
+    def _find(self, md5, phash):
+        row = self.conn.execute("SELECT path FROM images WHERE md5 = ?", (md5,)).fetchone()
+        if row:
+            return row[0]
+        if phash is None or self.near_duplicate_threshold is None:
+            return None
+        self._refresh()
+        match = self.perceptual_index.find(phash)
+        if match is None:
+            return None
+        row = self.conn.execute("SELECT path FROM images WHERE phash = ? LIMIT 1", (_to_signed(match),)).fetchone()
+        return row[0] if row else ""
+
+    def find(self, md5, phash=None):
+        """Path of an indexed copy or near-duplicate of this image, or None."""
+        with self.lock:
+            return self._find(md5, phash)
+
+    def add_if_new(self, md5, phash, path):
+        """Index an image unless a duplicate is already indexed; returns True if it was added."""
+        with self.lock:
+            if self._find(md5, phash) is not None:
+                return False
+            with self.conn:
+                added = self.conn.execute(
+                    "INSERT OR IGNORE INTO images VALUES (?, ?, ?)",
+                    (md5, _to_signed(phash) if phash is not None else None, path)).rowcount
+            # Another process may have indexed the same bytes first
+            self._refresh()
+            return bool(added)
+
+    def record_file(self, path, md5):
+        """Remember which hash a file on disk has, keyed by its size and mtime."""
+        st = os.stat(path)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                              (path, md5, st.st_size, st.st_mtime))
+
+    def scan(self, root, hash_file, perceptual_hash=dhash):
+        """Index image files under root that are new or changed since the last scan.
+
+        Returns (files seen, files hashed).
+        """
+        seen = hashed = 0
+        with self.lock:
+            known = {path: (size, mtime) for path, size, mtime
+                     in self.conn.execute("SELECT path, size, mtime FROM files")}
+        pending = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                    seen += 1
+                    if known.get(path) == (st.st_size, st.st_mtime):
+                        continue
+                    md5 = hash_file(path)
+                    phash = perceptual_hash(path) if self.near_duplicate_threshold is not None else None
+                except OSError:
+                    continue
+                hashed += 1
+                pending.append((md5, phash, path, st.st_size, st.st_mtime))
+                if len(pending) >= SCAN_COMMIT_EVERY:
+                    self._write_scanned(pending)
+                    pending = []
+        self._write_scanned(pending)
+        return seen, hashed
+
+    def _write_scanned(self, rows):
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO images VALUES (?, ?, ?)",
+                                  [(md5, _to_signed(phash) if phash is not None else None, path)
+                                   for md5, phash, path, _, _ in rows])
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                  [(path, md5, size, mtime) for md5, _, path, size, mtime in rows])
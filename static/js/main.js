@@ -12,6 +12,7 @@ let quantityInput, launchBtn, spinner, scrapeForm;
 let progressContainer, progressBar, progressText, currentEngineText, imagesFoundText;
 let eventSource = null;
 let currentSessionId = null;
+let progressState = {};
 
 // 🎨 Developer signature in the console - because why not? 
 console.log(`
@@ -285,6 +286,7 @@ function updateProgressDisplay(data) {
  */
 function startProgressTracking(sessionId) {
     currentSessionId = sessionId;
+    progressState = {};
     
     if (eventSource) {
         eventSource.close();
@@ -294,8 +296,9 @@ function startProgressTracking(sessionId) {
     
     eventSource.onmessage = function(event) {
         try {
-            const data = JSON.parse(event.data);
-            updateProgressDisplay(data);
+            // The server sends a full snapshot first, then only changed fields
+            progressState = Object.assign(progressState, JSON.parse(event.data));
+            updateProgressDisplay(progressState);
         } catch (error) {
             console.error('Error parsing progress data:', error);
         }
@@ -303,6 +306,11 @@ function startProgressTracking(sessionId) {
     
     eventSource.onerror = function(error) {
         console.error('EventSource error:', error);
+        // The server closes the stream once the job is finished
+        if (progressState.status === 'completed' || progressState.status === 'error') {
+            eventSource.close();
+            return;
+        }
         // Retry connection after a delay
         setTimeout(() => {
             if (currentSessionId) {
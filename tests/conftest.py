@@ -0,0 +1,33 @@
+import os
+import uuid
+
+import pytest
+
+from helpers import ImageServer, state_env
+
+
+@pytest.fixture(scope='session', autouse=True)
+def app_state(tmp_path_factory):
+    """Keep the in-process app's state out of /tmp (set before app is first imported)"""
+    root = tmp_path_factory.mktemp('state')
+    os.environ.update(state_env(root))
+    return root
+
+
+@pytest.fixture
+def image_server():
+    server = ImageServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app(app_state):
+    import app as app_module
+    return app_module
+
+
+@pytest.fixture
+def topic():
+    """A topic of its own, so tests sharing the session's app state never hit each other's searches"""
+    return f"test topic {uuid.uuid4().hex[:12]}"
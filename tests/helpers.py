@@ -0,0 +1,109 @@
+"""Test doubles shared by the tests and the worker processes they start: a local image server and
+stub search engines, so nothing reaches the network"""
+import io
+import os
+import sys
+import threading
+import http.server
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+STATE_PATHS = {  # everything app.py keeps between requests, by the variable that relocates it
+    'PROGRESS_DB': 'progress.db',
+    'IMAGE_STORE_DIR': 'image_store',
+    'IMAGE_STORE_DB': 'image_store.db',
+    'QUERY_CACHE_DIR': 'url_cache',
+    'SESSION_INDEX_DB': 'session_index.db',
+    'JOB_CHECKPOINT_DB': 'job_checkpoints.db',
+    'IMAGE_HASH_INDEX': 'hash_index.db',
+}
+IMAGE_SIZE = (120, 120)  # above MIN_IMAGE_DIMENSIONS, and noise keeps every JPEG over MIN_IMAGE_BYTES
+
+
+def state_env(root):
+    """Environment that keeps the app's databases, caches and image store under root"""
+    return {name: os.path.join(str(root), path) for name, path in STATE_PATHS.items()}
+
+
+class QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients abandon downloads (and get killed) mid-body on purpose
+
+
+class ImageServer:
+    """Threaded HTTP server with a distinct JPEG at /<n>.jpg, recording every path requested"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.paths = []
+        self.lock = threading.Lock()
+        self.images = {}
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server.lock:
+                    server.paths.append(self.path)
+                if server.delay:
+                    threading.Event().wait(server.delay)
+                data = server.image(int(self.path.strip('/').split('.')[0]))
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = QuietServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def image(self, n):
+        with self.lock:
+            if n not in self.images:
+                buf = io.BytesIO()
+                Image.effect_noise(IMAGE_SIZE, 40 + n % 60).convert('RGB').save(buf, 'JPEG')
+                self.images[n] = buf.getvalue()
+            return self.images[n]
+
+    @property
+    def hits(self):
+        with self.lock:
+            return len(self.paths)
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def register_stub_engine(app, base_url, name='stub', result_limit=None):
+    """Register an engine whose search returns image URLs from base_url, recording the size of
+    every search it is asked for (result_limit caps how many URLs a search can find)"""
+
+    class StubEngine(app.SearchEngine):
+        enabled = False  # only used when a request names it
+
+        def __init__(self):
+            super().__init__()
+            self.name = name
+            self.searches = []
+
+        def search(self, scraper, query, max_images):
+            self.searches.append(max_images)
+            count = max_images if result_limit is None else min(max_images, result_limit)
+            return [f"{base_url}/{n}.jpg" for n in range(count)]
+
+    return app.register_engine(StubEngine())
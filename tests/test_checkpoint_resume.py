@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from helpers import state_env
+
+WORKERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workers.py')
+QUANTITY = 100
+
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_killed_job_resumes_from_its_checkpoint(app, image_server, topic, tmp_path):
+    image_server.delay = 0.15
+    session_id = str(uuid.uuid4())
+    job = [sys.executable, WORKERS, 'checkpoint', image_server.base_url]
+    env = dict(os.environ, **state_env(tmp_path))  # both processes see the same, private state
+
+    worker = subprocess.Popen(job + ['start', session_id, topic, str(QUANTITY)],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(lambda: image_server.hits >= QUANTITY // 3, timeout=60)
+        time.sleep(app.JOB_CHECKPOINT_INTERVAL + 0.5)  # let a checkpoint flush land
+    finally:
+        worker.kill()
+        worker.wait()
+    hits_before = image_server.hits
+    fetched_before = set(image_server.paths[:hits_before])
+    assert len(fetched_before) < QUANTITY, "job finished before it was killed"
+
+    resumed = subprocess.run(job + ['resume', session_id, topic, str(QUANTITY)],
+                             env=env, capture_output=True, text=True, timeout=120)
+    result = json.loads(resumed.stdout.strip().splitlines()[-1])
+
+    assert result['resumed'], "job did not resume from a checkpoint"
+    assert result['images'] == QUANTITY
+    assert result['unique'] == QUANTITY
+    assert result['stored']
+    assert result['checkpoints_left'] == 0
+    # Checkpointed images are never fetched again (only URLs fetched after the last flush may be)
+    refetched = fetched_before & set(image_server.paths[hits_before:])
+    assert len(refetched) <= len(fetched_before) - result['resumed']
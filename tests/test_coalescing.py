@@ -0,0 +1,64 @@
+import threading
+import time
+import uuid
+
+from helpers import register_stub_engine
+
+
+def scrape_in_background(app, results, topic, quantity, engine):
+    session_id = str(uuid.uuid4())
+
+    def run():
+        results[session_id] = app.scrape_images_multi_engine(topic, quantity, session_id, None, (engine,))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_crawl(app, topic, engine):
+    key = (app.QueryCache.normalize_topic(topic), None, (engine,), False)
+    deadline = time.time() + 10
+    while key not in app.search_coalescer.inflight:
+        assert time.time() < deadline, "crawl never started"
+        time.sleep(0.01)
+
+
+def test_identical_searches_share_one_crawl(app, image_server, topic):
+    image_server.delay = 0.05
+    engine = register_stub_engine(app, image_server.base_url, 'stub-shared')
+    results = {}
+
+    leader = scrape_in_background(app, results, topic, 20, engine.name)
+    wait_for_crawl(app, topic, engine.name)
+    followers = [scrape_in_background(app, results, topic, 20, engine.name) for _ in range(4)]
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert engine.searches == [20 + app.ENGINE_RESULT_OVERSHOOT]
+    assert sorted(len(images) for images in results.values()) == [20] * 5
+
+
+def test_larger_follower_extends_the_crawl(app, image_server, topic):
+    image_server.delay = 0.05
+    engine = register_stub_engine(app, image_server.base_url, 'stub-extend')
+    results = {}
+
+    leader = scrape_in_background(app, results, topic, 10, engine.name)
+    wait_for_crawl(app, topic, engine.name)
+    follower = scrape_in_background(app, results, topic, 90, engine.name)
+    leader.join()
+    follower.join()
+
+    assert sorted(len(images) for images in results.values()) == [10, 90]
+    assert len(engine.searches) <= 2  # one crawl, at most one extra search round
+
+
+def test_short_results_are_not_cached(app, image_server, topic):
+    engine = register_stub_engine(app, image_server.base_url, 'stub-short', result_limit=5)
+    session_id = str(uuid.uuid4())
+
+    app.background_scrape(session_id, topic, 20, None, (engine.name,))
+
+    assert len(app.progress_snapshot(session_id)['images']) == 5
+    assert app.query_cache.get(app.QueryCache.make_key(topic, 20, (engine.name,), None)) is None
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from helpers import state_env
+
+WORKERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workers.py')
+WORKER_COUNT = 3
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(url, data=None, timeout=30):
+    """(status, body) of a GET, or a JSON POST when data is given"""
+    req = urllib.request.Request(url, data=json.dumps(data).encode() if data is not None else None,
+                                 headers={'Content-Type': 'application/json'} if data is not None else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+@pytest.fixture
+def workers(image_server, tmp_path):
+    """Base URLs of app worker processes sharing progress and images through SQLite"""
+    env = dict(os.environ, PROGRESS_BACKEND='sqlite', **state_env(tmp_path))
+    ports = [free_port() for _ in range(WORKER_COUNT)]
+    procs = [subprocess.Popen([sys.executable, WORKERS, 'serve', str(port), image_server.base_url], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+             for port in ports]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    try:
+        deadline = time.time() + 60
+        for url in urls:
+            while True:
+                try:
+                    if get(url + '/engines', timeout=2)[0] == 200:
+                        break
+                except OSError:
+                    pass
+                assert time.time() < deadline, "worker did not start"
+                time.sleep(0.2)
+        yield urls
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+
+def test_any_worker_serves_a_job_running_in_another(workers, topic):
+    status, body = get(workers[0] + '/scrape', {'topic': topic, 'quantity': 12, 'engines': ['stub']})
+    assert status == 200
+    session_id = json.loads(body)['session_id']
+
+    # The stream ends once the results are published (a worker blind to the job only sends keep-alives)
+    progress = {}
+    deadline = time.time() + 30
+    with urllib.request.urlopen(f"{workers[1]}/progress/{session_id}", timeout=30) as stream:
+        for line in stream:
+            if line.startswith(b'data: '):
+                progress.update(json.loads(line[6:]))
+            if time.time() > deadline:
+                break
+    assert progress.get('status') == 'completed'
+    assert progress.get('images_found') == 12
+
+    status, html = get(f"{workers[2]}/results/{session_id}")
+    assert status == 200
+    images = re.findall(rb'src="(/static/temp_images/[^"]+)"', html)
+    assert images
+    for i, path in enumerate(images):
+        assert get(workers[i % WORKER_COUNT] + path.decode())[0] == 200
+
+
+def put(store, tmp_path, data):
+    img_hash = hashlib.md5(data).hexdigest()
+    part_path = tmp_path / f"{img_hash}.part"
+    part_path.write_bytes(data)
+    return store.put(str(part_path), img_hash, '.jpg')
+
+
+def test_workers_never_collect_each_others_blobs(app, tmp_path):
+    root, db_path = str(tmp_path / 'store'), str(tmp_path / 'refs.db')
+    first = app.SQLiteBlobStore(root, db_path=db_path)
+    held = put(first, tmp_path, b'a' * 5000)
+    first.acquire(held, 'session-1')
+
+    # A worker started later, storing and dropping the same image itself
+    second = app.SQLiteBlobStore(root, db_path=db_path)
+    shared = put(first, tmp_path, b'b' * 5000)
+    first.acquire(shared, 'session-1')
+    put(second, tmp_path, b'b' * 5000)
+    second.acquire(shared, 'session-2')
+    second.release('session-2')
+
+    assert second.collect(grace=0) == 0
+    assert second.evict_lru(0, min_age=0) == 0
+    assert os.path.exists(first.path_for(held)) and os.path.exists(first.path_for(shared))
+
+    first.release('session-1')
+    assert second.collect(grace=0) == 2
+    assert not os.path.exists(first.path_for(held))
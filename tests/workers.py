@@ -0,0 +1,66 @@
+"""Processes started by the tests.
+
+    python workers.py checkpoint <image base url> start|resume <session id> <topic> <quantity>
+    python workers.py serve <port> <image base url>
+
+checkpoint/start runs a scrape job until the test kills it; checkpoint/resume resumes that job and
+prints its outcome as JSON. serve runs one app worker (PROGRESS_BACKEND comes from the environment).
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from helpers import register_stub_engine
+
+ENGINE = 'stub'
+
+
+def checkpoint(base_url, mode, session_id, topic, quantity):
+    import app
+    register_stub_engine(app, base_url, ENGINE)
+    app.job_checkpoints.stale = 1  # the killed job counts as dead after a second, not a minute
+    if mode == 'start':
+        app.background_scrape(session_id, topic, quantity, None, (ENGINE,))
+        return
+
+    time.sleep(app.job_checkpoints.stale + 0.2)
+    if not app.resume_job(session_id, 'test'):
+        print(json.dumps({'resumed': None}))
+        return
+    while True:
+        data = app.progress_snapshot(session_id) or {}
+        if data.get('status') in ('completed', 'error') and 'images' in data:
+            break
+        time.sleep(0.1)
+    images = data['images']
+    with sqlite3.connect(app.JOB_CHECKPOINT_DB) as conn:
+        left = conn.execute('SELECT COUNT(*) FROM jobs WHERE session_id = ?', (session_id,)).fetchone()[0]
+    print(json.dumps({
+        'resumed': data.get('resumed', 0),
+        'images': len(images),
+        'unique': len({img['hash'] for img in images}),
+        'stored': all(os.path.exists(img['local_path']) for img in images),
+        'checkpoints_left': left
+    }))
+
+
+def serve(port, base_url):
+    import app
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    register_stub_engine(app, base_url, ENGINE)
+    app.app.run(host='127.0.0.1', port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == 'checkpoint':
+        checkpoint(args[0], args[1], args[2], args[3], int(args[4]))
+    elif command == 'serve':
+        serve(int(args[0]), args[1])
+    else:
+        sys.exit(f"unknown command {command!r}")
+    sys.stdout.flush()
+    os._exit(0)  # skip joining the app's pools and daemon threads